@@ -0,0 +1,49 @@
+# app/build_lessons.py
+# Offline lesson generation (bulk re-generation, ingestion), outside the web and worker paths:
+#   python -m app.build_lessons items.jsonl > lessons.jsonl
+#   python -m app.build_lessons --batch items.jsonl > lessons.jsonl   (Batch API: half price, may take hours)
+# Each input line is a JSON object of build_mimi_lesson keyword arguments (topic, ocr_text,
+# image_descriptions, age); each output line is the lesson, or null when that item failed.
+import sys, json, asyncio, argparse
+from typing import Any, Dict, List, Optional
+
+from app import mimi
+
+def read_items(lines) -> List[Dict[str, Any]]:
+    items = []
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        if not isinstance(item, dict):
+            raise ValueError(f"line {n}: expected a JSON object")
+        items.append(item)
+    return items
+
+def build(items: List[Dict[str, Any]], batch: bool = False) -> List[Optional[Dict[str, Any]]]:
+    if batch:
+        return mimi.build_mimi_lesson_batch(items)
+    return asyncio.run(mimi.build_mimi_lessons(items))
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.build_lessons", description="Build Mimi lessons from a JSONL file.")
+    parser.add_argument("items", help="JSONL file of lesson arguments, or - for stdin")
+    parser.add_argument("--batch", action="store_true", help="go through the OpenAI Batch API and wait for it")
+    args = parser.parse_args(argv)
+
+    if args.items == "-":
+        items = read_items(sys.stdin)
+    else:
+        with open(args.items, encoding="utf-8") as f:
+            items = read_items(f)
+
+    lessons = build(items, batch=args.batch)
+    for lesson in lessons:
+        sys.stdout.write(json.dumps(lesson, ensure_ascii=False) + "\n")
+    failed = sum(lesson is None for lesson in lessons)
+    print(f"[BUILD] {len(lessons) - failed}/{len(lessons)} lessons built", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# app/cache.py
+import os, json
+from typing import Any, Optional
+
+# Reuse the Celery broker's Redis unless a dedicated one is configured
+REDIS_URL = os.getenv("REDIS_URL") or os.getenv("CELERY_BROKER_URL", "")
+
+_redis_client = None
+
+def redis_client():
+    """Lazy shared Redis client; None when no redis:// URL is configured or redis isn't installed."""
+    global _redis_client
+    if _redis_client is not None:
+        return _redis_client
+    if not REDIS_URL.startswith(("redis://", "rediss://")):
+        return None
+    try:
+        import redis  # requires 'redis' in requirements.txt
+        _redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+    except Exception as e:
+        print("[CACHE] Redis init failed:", repr(e))
+        _redis_client = None
+    return _redis_client
+
+def get_json(key: str) -> Optional[Any]:
+    """Return the cached JSON value for key, or None on miss / Redis trouble (never raises)."""
+    r = redis_client()
+    if r is None:
+        return None
+    try:
+        raw = r.get(key)
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        print("[CACHE] get failed:", repr(e))
+        return None
+
+def set_json(key: str, value: Any, ttl: int) -> None:
+    """Store value as JSON for ttl seconds; a no-op when ttl <= 0 or Redis is unavailable."""
+    r = redis_client()
+    if r is None or ttl <= 0:
+        return
+    try:
+        r.setex(key, ttl, json.dumps(value, ensure_ascii=False))
+    except Exception as e:
+        print("[CACHE] set failed:", repr(e))
+
+def acquire_lock(key: str, ttl: int) -> bool:
+    """SET NX a short-lived lock; True when we own it (or Redis is unavailable, so nobody can)."""
+    r = redis_client()
+    if r is None:
+        return True
+    try:
+        return bool(r.set(key, b"1", nx=True, ex=max(1, ttl)))
+    except Exception as e:
+        print("[CACHE] lock failed:", repr(e))
+        return True
+
+def release_lock(key: str) -> None:
+    r = redis_client()
+    if r is None:
+        return
+    try:
+        r.delete(key)
+    except Exception as e:
+        print("[CACHE] unlock failed:", repr(e))
@@ -20,6 +20,17 @@ celery_app.conf.update(
     broker_connection_retry_on_startup=True,
     task_ignore_result=True,          # set False if you need results
     worker_hijack_root_logger=False,  # let your app control logging
+    # Lesson jobs are long and I/O-bound (download, OCR, LLM): hand out one at a time
+    task_acks_late=True,              # ack after the job finishes, not on receipt
+    worker_prefetch_multiplier=int(os.getenv("CELERY_PREFETCH", "1") or 1),  # don't reserve jobs an idle worker could run
+    worker_max_tasks_per_child=int(os.getenv("CELERY_MAX_TASKS_PER_CHILD", "50") or 0),  # recycle children (PyMuPDF/HTTP leaks)
+    task_track_started=True,          # expose STARTED while a long job runs
+    broker_pool_limit=32,             # reuse publisher connections across web threads
+    # Pooled publisher sockets sit idle between uploads; keep NATs/LBs from silently dropping them
+    broker_transport_options={"socket_keepalive": True},
+    redis_backend_health_check_interval=30,
+    task_compression="gzip",          # shrink large task arguments on the broker
+    result_compression="gzip",
 )
 
 # Autodiscover tasks in the "app" package
@@ -1,14 +1,39 @@
 # app/main.py
-import os
-from flask import Flask, jsonify
+import os, gzip, hashlib
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from werkzeug.exceptions import HTTPException
 
 # ---- Flask app ----
 # Keep static at root so /styles.css works (static_url_path="")
 app = Flask(__name__, static_folder="static", static_url_path="")
+# Cap request bodies (raw image uploads are read in one go)
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_CONTENT_LENGTH", str(20 * 1024 * 1024)))
 CORS(app)
 
+# ---- JSON: orjson when available (large image/lesson payloads serialize several times faster) ----
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            # Not byte-identical to Flask's default: keys are sorted as before, but non-ASCII is
+            # written as raw UTF-8 (Flask escapes it) and datetimes come out ISO 8601, not HTTP dates
+            option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+            return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+        def loads(self, s, **kwargs):
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # orjson rejects what stdlib accepts (NaN/Infinity, ints past 64 bits, lone surrogates)
+                return super().loads(s, **kwargs)
+
+    app.json = OrjsonProvider(app)
+except Exception as e:
+    print("[BOOT] orjson not available, using stdlib json:", repr(e))
+
 # ---- Blueprints ----
 # Register BOTH blueprints so /api/... endpoints exist
 try:
@@ -29,9 +54,24 @@ def health():
     return jsonify(ok=True, status="healthy")
 
 # ---- Root: serve the SPA entry ----
+# index.html only changes on deploy: read it once, hash it, pre-gzip it, and answer refreshes with 304s
+def _load_index():
+    with open(os.path.join(app.static_folder, "index.html"), "rb") as f:
+        raw = f.read()
+    return raw, gzip.compress(raw, compresslevel=9), hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+_INDEX_RAW, _INDEX_GZ, _INDEX_ETAG = _load_index()
+
 @app.get("/")
 def index():
-    return app.send_static_file("index.html")
+    use_gzip = "gzip" in request.accept_encodings
+    resp = Response(_INDEX_GZ if use_gzip else _INDEX_RAW, mimetype="text/html")
+    if use_gzip:
+        resp.headers["Content-Encoding"] = "gzip"
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = "public, max-age=60, must-revalidate"
+    resp.set_etag(_INDEX_ETAG + ("-gz" if use_gzip else ""))
+    return resp.make_conditional(request)
 
 # ⚠️ IMPORTANT:
 # Do NOT add a catch-all `/<path:filename>` static route – it will swallow /api/* and cause 405 on POSTs.
@@ -50,6 +90,6 @@ def on_error(e):
     return jsonify(error=str(e)), 500
 
 # ---- Gunicorn entrypoint ----
-# $ gunicorn -w 1 -k gthread --threads 8 --timeout 300 --bind 0.0.0.0:5000 app.main:app
+# $ gunicorn -w 2 -k gevent --worker-connections 500 --timeout 300 --bind 0.0.0.0:$PORT app.main:app  (see Dockerfile)
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=True)
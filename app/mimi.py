@@ -1,31 +1,119 @@
 # app/mimi.py
-import os, json, time
-from typing import List, Dict, Any, Optional
+from __future__ import annotations
+
+import os, re, copy, json, time, random, hashlib, asyncio, weakref, threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Iterator, Optional
+
+from app import cache
+
+try:
+    import orjson  # 2–5× faster than stdlib json, UTF-8 native
+except Exception:
+    orjson = None  # type: ignore
+
+try:
+    import fastjsonschema  # compiled validators for the lesson contract
+except Exception:
+    fastjsonschema = None  # type: ignore
+
+try:
+    import tiktoken  # token-accurate excerpt budget (MIMI_INPUT_TOKENS)
+except Exception:
+    tiktoken = None  # type: ignore
 
 try:
     # OpenAI SDK path (if you choose to keep the SDK)
-    from openai import OpenAI  # requires 'openai' in requirements.txt
+    from openai import OpenAI, AsyncOpenAI  # requires 'openai' in requirements.txt
 except Exception:
     OpenAI = None  # type: ignore
+    AsyncOpenAI = None  # type: ignore
+
+def _dumps(obj: Any, sort_keys: bool = False) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys)
+
+_loads = orjson.loads if orjson is not None else json.loads  # both raise ValueError subclasses
+
+def _loads_lenient(text: str) -> Any:
+    """_loads, retried with stdlib json for what orjson rejects (NaN, lone surrogates) on repair paths."""
+    try:
+        return _loads(text)
+    except ValueError:
+        if orjson is None:
+            raise
+        return json.loads(text)
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL_TEXT = os.getenv("OPENAI_MODEL_TEXT", "gpt-4o-mini")
 OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))  # seconds
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))  # fail fast on dead routes
 OPENAI_RETRIES = int(os.getenv("OPENAI_RETRIES", "2"))
+MIMI_MAX_CONCURRENCY = int(os.getenv("MIMI_MAX_CONCURRENCY", "8") or 8)  # in-flight lesson calls per process
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "1") == "1"  # multiplex parallel calls over one connection
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64") or 64)
+BATCH_POLL_SECONDS = float(os.getenv("MIMI_BATCH_POLL_SECONDS", "30") or 30)  # first poll; doubles each round
+BATCH_POLL_MAX_SECONDS = float(os.getenv("MIMI_BATCH_POLL_MAX_SECONDS", "120") or 120)
+BATCH_MAX_WAIT_SECONDS = float(os.getenv("MIMI_BATCH_MAX_WAIT_SECONDS", str(24 * 3600)) or 24 * 3600)
+MIMI_EXCERPT_CHARS = int(os.getenv("MIMI_EXCERPT_CHARS", "8000") or 8000)  # OCR text sent to the model
+MIMI_IMAGE_DESC_CHARS = 300  # longer "descriptions" are OCR noise, not scene hints
+MIMI_INPUT_TOKENS = int(os.getenv("MIMI_INPUT_TOKENS", "0") or 0)  # total prompt budget; 0 keeps the char cap only
+LESSON_CACHE_TTL = int(os.getenv("LESSON_CACHE_TTL", "86400") or 0)  # seconds; 0 disables
+OPENAI_JSON_SCHEMA = os.getenv("OPENAI_JSON_SCHEMA", "0") == "1"  # send LESSON_SCHEMA as structured output
+MIMI_PROMPT_EXAMPLE = os.getenv("MIMI_PROMPT_EXAMPLE", "0") == "1"  # append a worked example to the system prompt
+
+try:
+    import httpx
+    # Generation may legitimately take OPENAI_TIMEOUT; a connection that can't open in 5 s won't
+    _CALL_TIMEOUT: Any = httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+except Exception:
+    _CALL_TIMEOUT = OPENAI_TIMEOUT
 
 # Single shared OpenAI client (SDK) — only if both key and SDK exist
-openai_client: Optional["OpenAI"] = None
-if OPENAI_API_KEY and OpenAI is not None:
+def _http_client():
+    """Pooled HTTP/2 transport for the SDK; None keeps the SDK's own default client."""
     try:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
+        import httpx
+        from openai import DefaultHttpxClient  # SDK defaults (timeouts, redirects) + our pool
+        return DefaultHttpxClient(
+            http2=OPENAI_HTTP2,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS // 2,
+            ),
+        )
     except Exception as e:
-        print("[BOOT] OpenAI client init failed:", repr(e))
-        openai_client = None
-else:
+        print("[BOOT] custom OpenAI HTTP client unavailable, using SDK default:", repr(e))
+        return None
+
+def _create_openai_client() -> Optional[OpenAI]:
+    if OPENAI_API_KEY and OpenAI is not None:
+        try:
+            return OpenAI(api_key=OPENAI_API_KEY, http_client=_http_client())
+        except Exception as e:
+            print("[BOOT] OpenAI client init failed:", repr(e))
+            return None
     if not OPENAI_API_KEY:
         print("[BOOT] OPENAI_API_KEY not set — running in demo mode")
     elif OpenAI is None:
         print("[BOOT] 'openai' package not installed — install or switch to requests fallback")
+    return None
+
+openai_client: Optional[OpenAI] = _create_openai_client()
+
+# Caps concurrent lesson generations per process so bursts queue here instead of tripping the RPM limit
+_openai_slots = threading.BoundedSemaphore(MIMI_MAX_CONCURRENCY)
+
+def _backoff(attempt: int) -> float:
+    """Jittered exponential delay: retries from concurrent workers spread out instead of stampeding."""
+    delay = 0.7 * (2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def reset_openai_client() -> None:
+    """Rebuild the shared client, e.g. in a freshly forked worker that must not reuse the parent's sockets."""
+    global openai_client
+    openai_client = _create_openai_client()
 
 SYSTEM_PROMPT = """
 You are Mimi, a warm, patient French tutor for an 11-year-old (A1–A2 level).
@@ -67,95 +155,296 @@ Rules:
 - End with a short multiple-choice quiz (2–3 questions).
 """
 
+# Served when there is no API key or SDK (local dev, CI)
+_DEMO_LESSON_RAW: Dict[str, Any] = {
+    "title": "Démo — Les symboles de la France",
+    "duration": "30 min",
+    "objectives": ["Reconnaître quelques symboles", "Dire 'C’est ...'"],
+    "materials": ["Images imprimées", "Crayons"],
+    "warm_up": {
+        "name": "Échauffement — Devine l’image",
+        "minutes": "5",
+        "teacher_script": "Regarde l’image. Qu’est-ce que c’est ? Répète : C’est un croissant !"
+    },
+    "vocab_cards": {
+        "name": "Cartes de vocabulaire",
+        "minutes": "8",
+        "teacher_script": "Associe la photo au mot. Répète ensemble."
+    },
+    "mini_story": {
+        "name": "Découverte — Carte du monde",
+        "minutes": "7",
+        "teacher_script": "On parle français dans plusieurs pays."
+    },
+    "phonics_focus": {
+        "name": "Sons — 'ou'",
+        "minutes": "4",
+        "teacher_script": "Écoute et répète le son 'ou' comme dans 'bonjour'."
+    },
+    "practice": {
+        "name": "Jeu de rôle — Guide & Touriste",
+        "minutes": "6",
+        "teacher_script": "Tu es le guide, je suis le touriste."
+    },
+    "wrap_up": {
+        "name": "Créatif — Dessin",
+        "minutes": "4",
+        "teacher_script": "Dessine ton symbole préféré et dis : C’est ..."
+    },
+    "homework": {
+        "name": "À la maison",
+        "minutes": "0",
+        "teacher_script": "Montre un symbole français à ta famille et dis : C’est ..."
+    },
+    "quiz": [
+        {
+            "question": "Comment dit-on 'hello' en français ?",
+            "options": ["Bonjour", "Merci", "Au revoir"],
+            "correct_option": "Bonjour",
+        }
+    ],
+    "image_prompts": [
+        {"id": "cover_scene", "prompt": "Kid-friendly illustration of the Eiffel Tower, bright colors, no text, no real faces"},
+        {"id": "vocab_card_croissant", "prompt": "Simple drawing of a croissant on a plate, no text"},
+        {"id": "story_frame", "prompt": "Children looking at a world map with France highlighted, cartoon style"},
+        {"id": "phonics_poster", "prompt": "Poster showing the French letters 'ou' with a smiling mouth diagram"},
+        {"id": "reward_sticker", "prompt": "Cute gold star sticker with a smiley face, flat design"}
+    ],
+    "first_tutor_messages": ["Bonjour ! Prêt(e) ? On commence avec un jeu de devinettes !"]
+}
+
+# OpenAI reuses cached prompt prefixes of 1024+ tokens. SYSTEM_PROMPT alone is ~450, so the optional
+# worked example (the demo lesson) lifts the static prefix over the threshold on busy deployments.
+_SYSTEM_TEXT = SYSTEM_PROMPT + (
+    "\nExample of a complete answer:\n" + _dumps(_DEMO_LESSON_RAW) if MIMI_PROMPT_EXAMPLE else ""
+)
+
+# The contract from SYSTEM_PROMPT as JSON Schema, for models that support structured outputs
+_ACTIVITY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "minutes": {"type": "string"},
+        "teacher_script": {"type": "string"},
+    },
+    "required": ["name", "minutes", "teacher_script"],
+    "additionalProperties": False,
+}
+_STR_LIST = {"type": "array", "items": {"type": "string"}}
+LESSON_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "duration": {"type": "string"},
+        "objectives": _STR_LIST,
+        "materials": _STR_LIST,
+        "warm_up": _ACTIVITY_SCHEMA,
+        "vocab_cards": _ACTIVITY_SCHEMA,
+        "mini_story": _ACTIVITY_SCHEMA,
+        "phonics_focus": _ACTIVITY_SCHEMA,
+        "practice": _ACTIVITY_SCHEMA,
+        "wrap_up": _ACTIVITY_SCHEMA,
+        "homework": _ACTIVITY_SCHEMA,
+        "image_prompts": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "string"}, "prompt": {"type": "string"}},
+                "required": ["id", "prompt"],
+                "additionalProperties": False,
+            },
+        },
+        "quiz": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question": {"type": "string"},
+                    "options": _STR_LIST,
+                    "correct_option": {"type": "string"},
+                },
+                "required": ["question", "options", "correct_option"],
+                "additionalProperties": False,
+            },
+        },
+        "first_tutor_messages": _STR_LIST,
+    },
+    "required": [
+        "title", "duration", "objectives", "materials", "warm_up", "vocab_cards", "mini_story",
+        "phonics_focus", "practice", "wrap_up", "homework", "image_prompts", "quiz", "first_tutor_messages",
+    ],
+    "additionalProperties": False,
+}
+
+# Built once; the SDK only reads these
+_JSON_RESPONSE: Dict[str, Any] = {"type": "json_object"}
+_SCHEMA_RESPONSE: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {"name": "mimi_lesson", "strict": True, "schema": LESSON_SCHEMA},
+}
+
+def _response_format() -> Dict[str, Any]:
+    """JSON mode by default; the strict schema when OPENAI_JSON_SCHEMA=1 (needs a structured-outputs model)."""
+    return _SCHEMA_RESPONSE if OPENAI_JSON_SCHEMA else _JSON_RESPONSE
+
+# Field aliases models drift to, in order of preference (read by _first in one pass each)
+_ALIASES: Dict[str, tuple] = {
+    "title": ("title", "lesson_title"),
+    "materials": ("materials", "material_list"),
+    "plan": ("plan", "activities", "sections"),
+    "image_prompts": ("image_prompts", "imagePrompts", "slides"),
+    "first_tutor_messages": ("first_tutor_messages", "firstTutorMessages"),
+    # inside an activity / plan step
+    "name": ("name", "title"),
+    "minutes": ("minutes", "duration", "duration_minutes"),
+    "script": ("teacher_script", "script"),
+    "prompt": ("prompt", "image_prompt"),
+}
+_NUMBER = (int, float)
+_ACTIVITY_KEYS = ("warm_up", "vocab_cards", "mini_story", "phonics_focus", "practice", "wrap_up", "homework")
+_ACTIVITY_NAMES = {k: k.replace("_", " ").title() for k in _ACTIVITY_KEYS}  # fallback display names
+
+# Compiled validators, keyed by the schema's JSON so schema variants can coexist
+_validators: Dict[str, Any] = {}
+
+def _schema_validator(schema: Dict[str, Any]):
+    if fastjsonschema is None:
+        return None
+    key = hashlib.blake2b(_dumps(schema, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+    validator = _validators.get(key)
+    if validator is None:
+        validator = _validators[key] = fastjsonschema.compile(schema)
+    return validator
+
+def _is_canonical(obj: Any) -> bool:
+    validator = _schema_validator(LESSON_SCHEMA)
+    if validator is None:
+        return False
+    try:
+        validator(obj)
+        return True
+    except fastjsonschema.JsonSchemaException:
+        return False
+
+def _canonical_lesson(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Strict shape from a response that already matches LESSON_SCHEMA: no alias hunting or coercion."""
+    if not 2 <= len(obj["objectives"]) <= 3:
+        raise ValueError("Expected 2-3 objectives")
+    if not obj["materials"]:
+        raise ValueError("Materials list required")
+    title = obj["title"] or "Leçon"
+    activities = {
+        k: {
+            "name": obj[k]["name"] or _ACTIVITY_NAMES[k],
+            "minutes": obj[k]["minutes"],
+            "teacher_script": obj[k]["teacher_script"],
+        }
+        for k in _ACTIVITY_KEYS
+    }
+    result: Dict[str, Any] = {
+        "title": title,
+        "duration": obj["duration"],
+        "objectives": obj["objectives"],
+        "materials": obj["materials"],
+        "plan": [a for a in activities.values() if a["teacher_script"] or a["minutes"]],
+        "image_prompts": [
+            {"id": it["id"] or f"img{i+1}", "prompt": it["prompt"]}
+            for i, it in enumerate(obj["image_prompts"]) if it["prompt"]
+        ],
+        "quiz": [
+            {"question": q["question"], "options": q["options"], "correct_option": q["correct_option"]}
+            for q in obj["quiz"] if q["question"] and q["options"]
+        ],
+        "first_tutor_messages": obj["first_tutor_messages"] or [f"Bonjour ! {title}"],
+    }
+    result.update(activities)
+    return result
+
+def _first(d: Dict[str, Any], keys: tuple, default: Any = None) -> Any:
+    """First truthy value among keys (same semantics as a chain of d.get(k) or ...)."""
+    for k in keys:
+        v = d.get(k)
+        if v:
+            return v
+    return default
+
+_TOP_FIELDS = ("title", "materials", "plan", "image_prompts", "first_tutor_messages")
+_STEP_FIELDS = ("name", "minutes", "script")
+
+def _as_list(value: Any) -> list:
+    """Lists pass through; a lone scalar (e.g. one material as a string) becomes a one-item list."""
+    match value:
+        case list():
+            return value
+        case None:
+            return []
+        case _:
+            return [str(value)]
+
+def _aliased(d: Dict[str, Any], fields: tuple) -> Dict[str, Any]:
+    """Resolve every alias chain in fields once, so later reads are a single dict lookup."""
+    return {f: _first(d, _ALIASES[f]) for f in fields}
+
+def _norm_step(raw: Dict[str, Any], default_name: str) -> Dict[str, str]:
+    """One activity / plan step as {name, minutes, teacher_script}."""
+    step = _aliased(raw, _STEP_FIELDS)
+    minutes = step["minutes"] or ""
+    if isinstance(minutes, _NUMBER):
+        minutes = str(int(minutes))
+    steps = raw.get("steps")
+    teacher_script = (
+        step["script"]
+        or (" • ".join(steps) if isinstance(steps, list) else raw.get("description"))
+        or ""
+    )
+    return {"name": step["name"] or default_name, "minutes": minutes, "teacher_script": teacher_script}
+
 def _normalize_to_strict_schema(obj: Dict[str, Any]) -> Dict[str, Any]:
-    title = obj.get("title") or obj.get("lesson_title") or "Leçon"
+    aliased = _aliased(obj, _TOP_FIELDS)
+    title = aliased["title"] or "Leçon"
 
     # duration normalization
-    if "duration" in obj and isinstance(obj["duration"], (int, float)):
-        duration = f"{int(obj['duration'])} min"
-    elif "duration" in obj and isinstance(obj["duration"], str):
-        duration = obj["duration"]
-    elif "duration_minutes" in obj:
-        try:
-            duration_val = int(obj.get("duration_minutes") or 30)
-        except Exception:
-            duration_val = 30
-        duration = f"{duration_val} min"
-    else:
-        duration = "30 min"
+    match obj.get("duration"):
+        case int() | float() as minutes:
+            duration = f"{int(minutes)} min"
+        case str() as duration:
+            pass
+        case _ if "duration_minutes" in obj:
+            try:
+                duration_val = int(obj.get("duration_minutes") or 30)
+            except Exception:
+                duration_val = 30
+            duration = f"{duration_val} min"
+        case _:
+            duration = "30 min"
 
-    objectives = obj.get("objectives") or []
-    if not isinstance(objectives, list):
-        objectives = [str(objectives)]
+    objectives = _as_list(obj.get("objectives") or None)
     if len(objectives) < 2 or len(objectives) > 3:
         raise ValueError("Expected 2-3 objectives")
 
-    materials = obj.get("materials") or obj.get("material_list") or []
-    if isinstance(materials, str):
-        materials = [materials]
-    if not isinstance(materials, list):
-        materials = [str(materials)]
+    materials = _as_list(aliased["materials"])
     if not materials:
         raise ValueError("Materials list required")
 
-    def _norm_activity(key: str) -> Dict[str, str]:
-        raw = obj.get(key) or {}
-        if not isinstance(raw, dict):
-            raw = {}
-        name = raw.get("name") or raw.get("title") or key.replace("_", " ").title()
-        minutes = raw.get("minutes") or raw.get("duration") or raw.get("duration_minutes") or ""
-        if isinstance(minutes, (int, float)):
-            minutes = str(int(minutes))
-        teacher_script = (
-            raw.get("teacher_script")
-            or raw.get("script")
-            or (" • ".join(raw.get("steps", [])) if isinstance(raw.get("steps"), list) else raw.get("description"))
-            or ""
-        )
-        return {"name": name, "minutes": minutes, "teacher_script": teacher_script}
-
-    activity_keys = [
-        "warm_up",
-        "vocab_cards",
-        "mini_story",
-        "phonics_focus",
-        "practice",
-        "wrap_up",
-        "homework",
-    ]
-    activities = {k: _norm_activity(k) for k in activity_keys}
+    activities = {}
+    for key in _ACTIVITY_KEYS:
+        raw = obj.get(key)
+        activities[key] = _norm_step(raw if isinstance(raw, dict) else {}, _ACTIVITY_NAMES[key])
 
     # plan normalization
-    plan_in = obj.get("plan") or obj.get("activities") or obj.get("sections") or []
-    plan_out: List[Dict[str, Any]] = []
+    plan_in = aliased["plan"] or []
     if isinstance(plan_in, list) and plan_in:
-        for step in plan_in:
-            if not isinstance(step, dict):
-                continue
-            name = step.get("name") or step.get("title") or "Étape"
-            minutes = step.get("minutes") or step.get("duration") or step.get("duration_minutes") or ""
-            if isinstance(minutes, (int, float)):
-                minutes = str(int(minutes))
-            teacher_script = (
-                step.get("teacher_script")
-                or step.get("script")
-                or (" • ".join(step.get("steps", [])) if isinstance(step.get("steps"), list) else step.get("description"))
-                or ""
-            )
-            plan_out.append({"name": name, "minutes": minutes, "teacher_script": teacher_script})
+        plan_out = [_norm_step(step, "Étape") for step in plan_in if isinstance(step, dict)]
     else:
-        for key in activity_keys:
-            act = activities.get(key)
-            if act.get("teacher_script") or act.get("minutes"):
-                plan_out.append(act)
+        plan_out = [act for act in activities.values() if act["teacher_script"] or act["minutes"]]
 
     # image prompts normalization
-    image_prompts_in = obj.get("image_prompts") or obj.get("imagePrompts") or obj.get("slides") or []
+    image_prompts_in = aliased["image_prompts"] or []
     image_prompts: List[Dict[str, str]] = []
     if isinstance(image_prompts_in, list):
         for i, it in enumerate(image_prompts_in):
             if isinstance(it, dict):
-                prompt = it.get("prompt") or it.get("image_prompt")
+                prompt = _first(it, _ALIASES["prompt"])
                 if not prompt and isinstance(it.get("bullets"), list):
                     prompt = "Illustration pour: " + ", ".join(it["bullets"][:3])
                 if prompt:
@@ -169,12 +458,7 @@ def _normalize_to_strict_schema(obj: Dict[str, Any]) -> Dict[str, Any]:
             if not isinstance(it, dict):
                 continue
             question = it.get("question")
-            options = it.get("options") or []
-            if isinstance(options, str):
-                options = [options]
-            if not isinstance(options, list):
-                options = [str(options)]
-            options = [str(o) for o in options]
+            options = [str(o) for o in _as_list(it.get("options") or None)]
             if question and options:
                 quiz.append({
                     "question": str(question),
@@ -182,7 +466,7 @@ def _normalize_to_strict_schema(obj: Dict[str, Any]) -> Dict[str, Any]:
                     "correct_option": it.get("correct_option"),
                 })
 
-    first_tutor_messages = obj.get("first_tutor_messages") or obj.get("firstTutorMessages") or []
+    first_tutor_messages = aliased["first_tutor_messages"] or []
     if not isinstance(first_tutor_messages, list) or not first_tutor_messages:
         first_tutor_messages = [f"Bonjour ! {title}"]
     result: Dict[str, Any] = {
@@ -200,125 +484,309 @@ def _normalize_to_strict_schema(obj: Dict[str, Any]) -> Dict[str, Any]:
 
 def _extract_json_loose(text: str) -> Dict[str, Any]:
     """As a last resort, try to find the outermost JSON object in text."""
+    if text.startswith("```"):
+        # ```json ... ``` fences are the usual culprit: unwrap them before scanning
+        unfenced = text.removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+        try:
+            return _loads_lenient(unfenced)
+        except ValueError:
+            text = unfenced
     start = text.find("{")
     end = text.rfind("}")
     if start != -1 and end != -1 and end > start:
         try:
-            return json.loads(text[start:end+1])
+            return _loads_lenient(text[start:end+1])
         except Exception:
             pass
+    # Stray braces in prose or several candidate objects: try each balanced top-level span,
+    # longest first, preferring one that looks like a lesson
+    fallback = None
+    for a, b in sorted(_object_spans(text), key=lambda ab: ab[0] - ab[1]):
+        try:
+            obj = _loads_lenient(text[a:b])
+        except ValueError:
+            continue
+        if not isinstance(obj, dict):
+            continue
+        if "title" in obj or "objectives" in obj:
+            return obj
+        fallback = fallback or obj
+    if fallback is not None:
+        return fallback
     raise ValueError("Model did not return valid JSON")
 
-def _chat_json_strict(payload: Dict[str, Any]) -> Dict[str, Any]:
-    # Demo path if no key or no client
-    if not OPENAI_API_KEY or openai_client is None:
-        demo = {
-            "title": "Démo — Les symboles de la France",
-            "duration": "30 min",
-            "objectives": ["Reconnaître quelques symboles", "Dire 'C’est ...'"] ,
-            "materials": ["Images imprimées", "Crayons"],
-            "warm_up": {
-                "name": "Échauffement — Devine l’image",
-                "minutes": "5",
-                "teacher_script": "Regarde l’image. Qu’est-ce que c’est ? Répète : C’est un croissant !"
-            },
-            "vocab_cards": {
-                "name": "Cartes de vocabulaire",
-                "minutes": "8",
-                "teacher_script": "Associe la photo au mot. Répète ensemble."
-            },
-            "mini_story": {
-                "name": "Découverte — Carte du monde",
-                "minutes": "7",
-                "teacher_script": "On parle français dans plusieurs pays."
-            },
-            "phonics_focus": {
-                "name": "Sons — 'ou'",
-                "minutes": "4",
-                "teacher_script": "Écoute et répète le son 'ou' comme dans 'bonjour'."
-            },
-            "practice": {
-                "name": "Jeu de rôle — Guide & Touriste",
-                "minutes": "6",
-                "teacher_script": "Tu es le guide, je suis le touriste."
-            },
-            "wrap_up": {
-                "name": "Créatif — Dessin",
-                "minutes": "4",
-                "teacher_script": "Dessine ton symbole préféré et dis : C’est ..."
-            },
-            "homework": {
-                "name": "À la maison",
-                "minutes": "0",
-                "teacher_script": "Montre un symbole français à ta famille et dis : C’est ..."
-            },
-            "quiz": [
-                {
-                    "question": "Comment dit-on 'hello' en français ?",
-                    "options": ["Bonjour", "Merci", "Au revoir"],
-                    "correct_option": "Bonjour",
-                }
-            ],
-            "image_prompts": [
-                {"id": "cover_scene", "prompt": "Kid-friendly illustration of the Eiffel Tower, bright colors, no text, no real faces"},
-                {"id": "vocab_card_croissant", "prompt": "Simple drawing of a croissant on a plate, no text"},
-                {"id": "story_frame", "prompt": "Children looking at a world map with France highlighted, cartoon style"},
-                {"id": "phonics_poster", "prompt": "Poster showing the French letters 'ou' with a smiling mouth diagram"},
-                {"id": "reward_sticker", "prompt": "Cute gold star sticker with a smiley face, flat design"}
-            ],
-            "first_tutor_messages": ["Bonjour ! Prêt(e) ? On commence avec un jeu de devinettes !"]
-        }
-        return _normalize_to_strict_schema(demo)
+def _object_spans(text: str) -> List[tuple]:
+    """(start, end) of every balanced top-level {...} in text; quotes only count inside braces."""
+    spans: List[tuple] = []
+    depth, start, in_str, esc = 0, -1, False, False
+    for i, ch in enumerate(text):
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif depth == 0:
+            continue  # prose between objects
+        elif ch == '"':
+            in_str = True
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                spans.append((start, i + 1))
+    return spans
+
+# Prompt/format changes must not serve lessons generated under the old contract
+_PROMPT_HASH = hashlib.blake2b(_SYSTEM_TEXT.encode("utf-8"), digest_size=8).hexdigest()
 
+def _cache_key(payload: Dict[str, Any]) -> str:
+    # "Les Couleurs" and "les couleurs" get the same lesson: the topic is only a hint to the model
+    if isinstance(payload.get("topic_hint"), str):
+        payload = {**payload, "topic_hint": payload["topic_hint"].casefold()}
+    blob = _dumps([OPENAI_MODEL_TEXT, _PROMPT_HASH, OPENAI_JSON_SCHEMA, payload], sort_keys=True)
+    return "lesson:" + hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+# Per-process LRU in front of Redis: repeat lessons skip even the Redis round-trip.
+# Entries are stored serialized so callers can mutate what they get back.
+LESSON_LRU_SIZE = int(os.getenv("LESSON_LRU_SIZE", "256") or 0)
+_lesson_lru: OrderedDict[str, str] = OrderedDict()
+_lesson_lru_lock = threading.Lock()
+
+def _lru_put(key: str, blob: str) -> None:
+    if LESSON_LRU_SIZE <= 0:
+        return
+    with _lesson_lru_lock:
+        _lesson_lru[key] = blob
+        _lesson_lru.move_to_end(key)
+        while len(_lesson_lru) > LESSON_LRU_SIZE:
+            _lesson_lru.popitem(last=False)
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    with _lesson_lru_lock:
+        blob = _lesson_lru.get(key)
+        if blob is not None:
+            _lesson_lru.move_to_end(key)
+    if blob is not None:
+        return _loads(blob)
+    lesson = cache.get_json(key)
+    if lesson is not None:
+        _lru_put(key, _dumps(lesson))
+    return lesson
+
+def _cache_set(key: str, lesson: Dict[str, Any]) -> None:
+    _lru_put(key, _dumps(lesson))
+    cache.set_json(key, lesson, LESSON_CACHE_TTL)
+
+_WS_RUN = re.compile(r"[ \t\f\v\u00a0]+")
+
+def _squash_excerpt(text: str) -> str:
+    """
+    Collapse whitespace and drop blank and repeated lines (page headers/footers, numbering).
+    Input tokens drive latency, and OCR text is often half filler.
+    """
+    lines = (_WS_RUN.sub(" ", line).strip() for line in text[:MIMI_EXCERPT_CHARS * 4].splitlines())
+    return "\n".join(dict.fromkeys(line for line in lines if line))[:MIMI_EXCERPT_CHARS]
+
+def _excerpt_encoding():
+    # Resolved once at import: the BPE tables may need a download, which must not happen per call
+    if not MIMI_INPUT_TOKENS or tiktoken is None:
+        return None, 0
+    try:
+        try:
+            enc = tiktoken.encoding_for_model(OPENAI_MODEL_TEXT)
+        except KeyError:
+            enc = tiktoken.get_encoding("o200k_base")
+        system_tokens = len(enc.encode(_SYSTEM_TEXT))
+    except Exception as e:
+        print("[BOOT] tiktoken unavailable, excerpt stays char-capped:", repr(e))
+        return None, 0
+    # What's left once the system prompt and the rest of the payload (~500 tokens) are paid for
+    return enc, max(0, MIMI_INPUT_TOKENS - system_tokens - 500)
+
+_EXCERPT_ENC, _EXCERPT_TOKENS = _excerpt_encoding()
+
+def _budget_excerpt(text: str) -> str:
+    if _EXCERPT_ENC is None:
+        return text
+    tokens = _EXCERPT_ENC.encode(text)
+    return text if len(tokens) <= _EXCERPT_TOKENS else _EXCERPT_ENC.decode(tokens[:_EXCERPT_TOKENS])
+
+def _trim_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
     # Trim long text defensively
     payload = dict(payload)
+    if isinstance(payload.get("topic_hint"), str):
+        payload["topic_hint"] = _WS_RUN.sub(" ", payload["topic_hint"]).strip()
     if isinstance(payload.get("pdf_text_excerpt"), str):
-        payload["pdf_text_excerpt"] = payload["pdf_text_excerpt"][:12000]
+        payload["pdf_text_excerpt"] = _budget_excerpt(_squash_excerpt(payload["pdf_text_excerpt"]))
+    if isinstance(payload.get("image_descriptions"), list):
+        payload["image_descriptions"] = [
+            d.strip() for d in payload["image_descriptions"]
+            if isinstance(d, str) and d.strip() and len(d) <= MIMI_IMAGE_DESC_CHARS
+        ]
+    return payload
+
+_SYS_MSG: Dict[str, str] = {"role": "system", "content": _SYSTEM_TEXT}  # static: keeps the cached prefix stable
+
+def _lesson_messages(payload: Dict[str, Any]) -> List[Dict[str, str]]:
+    return [_SYS_MSG, {"role": "user", "content": _dumps(payload)}]
+
+def _parse_lesson_text(text: str) -> Dict[str, Any]:
+    text = text.strip()
+    try:
+        raw = _loads(text)  # ideal: enforced JSON
+    except ValueError:
+        # Fallback: loose extraction if model accidentally added stray chars
+        raw = _extract_json_loose(text)
+    if OPENAI_JSON_SCHEMA:
+        # Strict structured outputs: the API already enforced LESSON_SCHEMA, nothing to validate
+        try:
+            return _canonical_lesson(raw)
+        except (KeyError, TypeError):
+            pass  # refusal or truncated output; let the normalizer have a go
+    if _is_canonical(raw):
+        return _canonical_lesson(raw)
+    return _normalize_to_strict_schema(raw)  # repair path for drifted responses
+
+_DEMO_LESSON: Dict[str, Any] = _normalize_to_strict_schema(_DEMO_LESSON_RAW)  # normalized once, at import
 
-    # Tiny retry with exponential backoff
+def _chat_json_strict(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Demo path if no key or no client
+    if not OPENAI_API_KEY or openai_client is None:
+        return copy.deepcopy(_DEMO_LESSON)  # callers mutate lessons (ui_steps)
+
+    payload = _trim_payload(payload)
+
+    # Identical inputs (re-uploads, retries) reuse the last generated lesson
+    key = _cache_key(payload)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    # Tiny retry with jittered backoff; this loop owns retries, so the SDK's own are switched off
+    client = openai_client.with_options(max_retries=0)
     last_err = None
     for attempt in range(OPENAI_RETRIES + 1):
         try:
-            resp = openai_client.chat.completions.create(
-                model=OPENAI_MODEL_TEXT,
-                temperature=0.4,
-                response_format={"type": "json_object"},
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
-                ],
-                timeout=OPENAI_TIMEOUT,
-            )
+            with _openai_slots:
+                resp = client.chat.completions.create(
+                    model=OPENAI_MODEL_TEXT,
+                    temperature=0.4,
+                    response_format=_response_format(),
+                    messages=_lesson_messages(payload),
+                    timeout=_CALL_TIMEOUT,
+                )
             if not resp.choices:
                 raise ValueError("No choices returned from model")
-            text = (resp.choices[0].message.content or "").strip()
-            try:
-                raw = json.loads(text)  # ideal: enforced JSON
-            except json.JSONDecodeError:
-                # Fallback: loose extraction if model accidentally added stray chars
-                raw = _extract_json_loose(text)
-            return _normalize_to_strict_schema(raw)
+            lesson = _parse_lesson_text(resp.choices[0].message.content or "")
+            _cache_set(key, lesson)  # only well-formed lessons are cached
+            return lesson
         except Exception as e:
             last_err = e
+            print(f"[MIMI] attempt {attempt + 1}/{OPENAI_RETRIES + 1} failed:", repr(e))
             if attempt < OPENAI_RETRIES:
-                time.sleep(0.7 * (2 ** attempt))
+                time.sleep(_backoff(attempt))
             else:
                 raise
 
     # Should never reach (loop returns or raises)
     raise RuntimeError(f"OpenAI call failed: {last_err}")
 
-def build_mimi_lesson(topic: str = "", ocr_text: str = "", image_descriptions: Optional[List[str]] = None, age: int = 11) -> Dict[str, Any]:
-    if image_descriptions is None:
-        image_descriptions = []
-    payload = {
+def _chat_json_strict_batch(payloads: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Offline variant of _chat_json_strict over the OpenAI Batch API (half price, separate quota,
+    results within the 24h window). Returns lessons in input order; None where a request failed.
+    """
+    if not OPENAI_API_KEY or openai_client is None:
+        return [_chat_json_strict(p) for p in payloads]
+
+    payloads = [_trim_payload(p) for p in payloads]
+    keys = [_cache_key(p) for p in payloads]
+    results: List[Optional[Dict[str, Any]]] = [_cache_get(k) for k in keys]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if not todo:
+        return results
+
+    lines = []
+    for i in todo:
+        lines.append(_dumps({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": OPENAI_MODEL_TEXT,
+                "temperature": 0.4,
+                "response_format": _response_format(),
+                "messages": _lesson_messages(payloads[i]),
+            },
+        }))
+    batch_file = openai_client.files.create(
+        file=("mimi_lessons.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch",
+    )
+    batch = openai_client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+    # Small batches finish in minutes, big ones in hours: poll quickly at first, then back off
+    deadline = time.monotonic() + BATCH_MAX_WAIT_SECONDS
+    interval = BATCH_POLL_SECONDS
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"OpenAI batch {batch.id} still {batch.status}")
+        time.sleep(interval)
+        interval = min(interval * 2, BATCH_POLL_MAX_SECONDS)
+        batch = openai_client.batches.retrieve(batch.id)
+    if not batch.output_file_id:
+        raise RuntimeError(f"OpenAI batch {batch.id} ended as {batch.status} without output")
+
+    for line in openai_client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        row = _loads(line)
+        i = int(row["custom_id"])
+        try:
+            body = row["response"]["body"]
+            lesson = _parse_lesson_text(body["choices"][0]["message"]["content"] or "")
+        except Exception as e:
+            print("[MIMI][BATCH] request", i, "failed:", repr(e))
+            continue
+        _cache_set(keys[i], lesson)
+        results[i] = lesson
+    return results
+
+def _lesson_payload(topic: str, ocr_text: str, image_descriptions: Optional[List[str]], age: int) -> Dict[str, Any]:
+    return {
         "topic_hint": topic or "",
-        "pdf_text_excerpt": (ocr_text or "")[:12000],
-        "image_descriptions": image_descriptions,
+        "pdf_text_excerpt": ocr_text or "",  # squashed/trimmed in _trim_payload
+        "image_descriptions": image_descriptions or [],
         "age": age
     }
-    lesson = _chat_json_strict(payload)
 
+# Activities previewed in ui_steps, with the step label used when the model left the name empty
+_PREVIEW_KEYS: Dict[str, str] = {
+    "warm_up": "Warm-up",
+    "vocab_cards": "Vocabulary",
+    "mini_story": "Mini-story",
+    "phonics_focus": "Phonics",
+    "practice": "Practice",
+    "wrap_up": "Wrap-up",
+}
+
+def _preview_step(key: str, block: Any) -> tuple:
+    """(step name, first script line or "") for one activity block."""
+    if not isinstance(block, dict):
+        block = {}
+    script = block.get("teacher_script") or ""
+    return block.get("name") or _PREVIEW_KEYS[key], script.partition("\n")[0][:140]
+
+def _add_ui_steps(lesson: Dict[str, Any], topic: str, ocr_text: str) -> Dict[str, Any]:
     # Ensure materials is always a list for the client
     materials = lesson.get("materials") or []
     if isinstance(materials, str):
@@ -327,22 +795,11 @@ def build_mimi_lesson(topic: str = "", ocr_text: str = "", image_descriptions: O
 
     # Preview snippets for specific activities
     ui_steps: List[Dict[str, str]] = []
-    preview_keys = [
-        ("warm_up", "Warm-up"),
-        ("vocab_cards", "Vocabulary"),
-        ("mini_story", "Mini-story"),
-        ("phonics_focus", "Phonics"),
-        ("practice", "Practice"),
-        ("wrap_up", "Wrap-up"),
-    ]
-    for key, fallback in preview_keys:
-        block = lesson.get(key) or {}
-        name = block.get("name") or fallback
-        script = block.get("teacher_script") or ""
-        if name or script:
-            ui_steps.append({"step": name})
-            if script:
-                ui_steps.append({"prompt": script.split("\n")[0][:140]})
+    for key in _PREVIEW_KEYS:
+        name, prompt = _preview_step(key, lesson.get(key))
+        ui_steps.append({"step": name})
+        if prompt:
+            ui_steps.append({"prompt": prompt})
 
     if not ui_steps:
         preview = (ocr_text or topic or "Nouvelle leçon").strip()[:160]
@@ -350,8 +807,7 @@ def build_mimi_lesson(topic: str = "", ocr_text: str = "", image_descriptions: O
             {"step": f"Explorons : {preview}"},
             {"prompt": "Répète : Bonjour Mimi ! Je suis prêt(e) à apprendre !"}
         ]
-    quiz = lesson.get("quiz") or []
-    for q in quiz:
+    for q in lesson.get("quiz") or ():
         ui_steps.append({
             "type": "question",
             "question": q["question"],
@@ -361,3 +817,251 @@ def build_mimi_lesson(topic: str = "", ocr_text: str = "", image_descriptions: O
 
     lesson["ui_steps"] = ui_steps
     return lesson
+
+def build_mimi_lesson(topic: str = "", ocr_text: str = "", image_descriptions: Optional[List[str]] = None, age: int = 11) -> Dict[str, Any]:
+    """Offline jobs that can wait for the Batch API use build_mimi_lesson_batch instead."""
+    lesson = _chat_json_strict(_lesson_payload(topic, ocr_text, image_descriptions, age))
+    return _add_ui_steps(lesson, topic, ocr_text)
+
+class _TopLevelScanner:
+    """
+    Incremental scanner over a streamed JSON object: returns each top-level "key": value pair
+    as soon as its value is closed, so callers can render sections before the object ends.
+    """
+
+    def __init__(self) -> None:
+        self.buf = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+        self.seg_start = -1
+        self.closed = False  # the top-level object has ended; anything after it is noise
+        self.fenced = False
+
+    def feed(self, text: str) -> List[tuple]:
+        """Raises ValueError as soon as the output can't be a JSON object (so callers can hang up)."""
+        self.buf += text
+        done: List[tuple] = []
+        buf = self.buf
+        for i in range(self.pos, len(buf)):
+            ch = buf[i]
+            if self.closed:
+                break
+            if self.depth == 0 and ch != "{":
+                if ch == "`":
+                    self.fenced = True  # tolerate a ```json fence before the object
+                elif not (ch.isspace() or self.fenced):
+                    raise ValueError(f"Model output does not start with a JSON object: {buf[i:i+20]!r}")
+                continue
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.seg_start = i + 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    done += self._pair(buf[self.seg_start:i])
+                    self.closed = True
+            elif ch == "," and self.depth == 1:
+                done += self._pair(buf[self.seg_start:i])
+                self.seg_start = i + 1
+        self.pos = len(buf)
+        return done
+
+    @staticmethod
+    def _pair(segment: str) -> List[tuple]:
+        if not segment.strip():
+            return []
+        try:
+            return list(_loads("{" + segment + "}").items())
+        except ValueError:
+            return []
+
+def stream_mimi_lesson(topic: str = "", ocr_text: str = "", image_descriptions: Optional[List[str]] = None, age: int = 11) -> Iterator[Dict[str, Any]]:
+    """
+    Same lesson as build_mimi_lesson, but yields {"type": "delta", "text": ...} events as the
+    model writes, {"type": "section", "key": ..., "value": ...} as each top-level key completes,
+    and a final {"type": "lesson", "lesson": ...} once the JSON is complete.
+
+    Live streams are framed by "stream_start" / "stream_end" and also carry UI-ready blocks, so
+    the tutor panel can speak before the plan is finished: each previewed activity becomes
+    content_block_start {index, name} -> text_delta {index, delta} -> content_block_end {index},
+    and first_tutor_messages is forwarded as {"type": "tutor_messages", "messages": [...]}.
+    The final lesson's ui_steps remain the authoritative order.
+    Demo mode and cache hits yield only the final event. No retries: deltas may already be sent.
+    """
+    payload = _trim_payload(_lesson_payload(topic, ocr_text, image_descriptions, age))
+    if not OPENAI_API_KEY or openai_client is None:
+        yield {"type": "lesson", "lesson": _add_ui_steps(_chat_json_strict(payload), topic, ocr_text)}
+        return
+
+    key = _cache_key(payload)
+    lesson = _cache_get(key)
+    if lesson is None:
+        parts: List[str] = []
+        scanner = _TopLevelScanner()
+        block_index = 0
+        yield {"type": "stream_start"}
+        with _openai_slots:  # held for the whole stream; released if the client disconnects
+            stream = openai_client.chat.completions.create(
+                model=OPENAI_MODEL_TEXT,
+                temperature=0.4,
+                response_format=_response_format(),
+                messages=_lesson_messages(payload),
+                timeout=_CALL_TIMEOUT,
+                stream=True,
+            )
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    yield {"type": "delta", "text": delta}
+                    for k, v in scanner.feed(delta):
+                        yield {"type": "section", "key": k, "value": v}
+                        if k in _PREVIEW_KEYS:
+                            name, prompt = _preview_step(k, v)
+                            yield {"type": "content_block_start", "index": block_index, "name": name}
+                            if prompt:
+                                yield {"type": "text_delta", "index": block_index, "delta": prompt}
+                            yield {"type": "content_block_end", "index": block_index}
+                            block_index += 1
+                        elif k in _ALIASES["first_tutor_messages"] and isinstance(v, list) and v:
+                            yield {"type": "tutor_messages", "messages": v}
+                    if scanner.closed:
+                        break  # the object is complete: stop paying for trailing tokens
+            finally:
+                stream.close()  # stopping early must release the HTTP connection
+        lesson = _parse_lesson_text("".join(parts))  # parse only once the stream is closed
+        _cache_set(key, lesson)
+        yield {"type": "stream_end"}
+    yield {"type": "lesson", "lesson": _add_ui_steps(lesson, topic, ocr_text)}
+
+def build_mimi_lesson_batch(items: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    """
+    build_mimi_lesson for offline jobs (bulk re-generation, ingestion) through the Batch API.
+    Each item takes the same keyword arguments as build_mimi_lesson. Blocks until the batch ends;
+    never use it on an interactive path.
+    """
+    payloads = [
+        _lesson_payload(r.get("topic", ""), r.get("ocr_text", ""), r.get("image_descriptions"), r.get("age", 11))
+        for r in items
+    ]
+    lessons = _chat_json_strict_batch(payloads)
+    return [
+        _add_ui_steps(lesson, r.get("topic", ""), r.get("ocr_text", "")) if lesson is not None else None
+        for r, lesson in zip(items, lessons)
+    ]
+
+# ---- Async variant (for callers running an event loop, e.g. batch generation) ----
+# httpx async pools are bound to the loop that created them, so keep one client per running loop
+_async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any] = weakref.WeakKeyDictionary()
+
+def _async_openai_client():
+    if not OPENAI_API_KEY or AsyncOpenAI is None:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        try:
+            import httpx
+            from openai import DefaultAsyncHttpxClient
+            http_client = DefaultAsyncHttpxClient(
+                http2=OPENAI_HTTP2,
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS // 2,
+                ),
+            )
+        except Exception:
+            http_client = None
+        # Lesson-only client: _chat_json_strict_async retries itself, so no SDK retries underneath
+        client = _async_clients[loop] = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0)
+    return client
+
+async def close_async_openai_client() -> None:
+    """
+    Close this loop's client and its httpx pool. Callers that wrap work in a short-lived
+    asyncio.run() loop call this before the loop ends, so sockets are not left to the GC.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+_async_slots: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+def _async_slot() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _async_slots.get(loop)
+    if sem is None:
+        sem = _async_slots[loop] = asyncio.Semaphore(MIMI_MAX_CONCURRENCY)
+    return sem
+
+async def _chat_json_strict_async(payload: Dict[str, Any]) -> Dict[str, Any]:
+    client = _async_openai_client()
+    if client is None:
+        return _chat_json_strict(payload)  # demo lesson, no network
+
+    payload = _trim_payload(payload)
+    key = _cache_key(payload)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    for attempt in range(OPENAI_RETRIES + 1):
+        try:
+            async with _async_slot():
+                resp = await client.chat.completions.create(
+                    model=OPENAI_MODEL_TEXT,
+                    temperature=0.4,
+                    response_format=_response_format(),
+                    messages=_lesson_messages(payload),
+                    timeout=_CALL_TIMEOUT,
+                )
+            if not resp.choices:
+                raise ValueError("No choices returned from model")
+            lesson = _parse_lesson_text(resp.choices[0].message.content or "")
+            _cache_set(key, lesson)
+            return lesson
+        except Exception as e:
+            print(f"[MIMI] async attempt {attempt + 1}/{OPENAI_RETRIES + 1} failed:", repr(e))
+            if attempt >= OPENAI_RETRIES:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+    raise RuntimeError("unreachable")
+
+async def build_mimi_lesson_async(topic: str = "", ocr_text: str = "", image_descriptions: Optional[List[str]] = None, age: int = 11) -> Dict[str, Any]:
+    """Coroutine twin of build_mimi_lesson: many lessons can be in flight on one thread."""
+    lesson = await _chat_json_strict_async(_lesson_payload(topic, ocr_text, image_descriptions, age))
+    return _add_ui_steps(lesson, topic, ocr_text)
+
+async def build_mimi_lessons(items: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Interactive fan-out: build several lessons concurrently (bounded by MIMI_MAX_CONCURRENCY).
+    Items take build_mimi_lesson's keyword arguments; failed items come back as None, in order.
+    Closes this loop's client when done, so it is safe to call from a one-shot asyncio.run().
+    """
+    try:
+        results = await asyncio.gather(*(build_mimi_lesson_async(**r) for r in items), return_exceptions=True)
+    finally:
+        await close_async_openai_client()
+    lessons: List[Optional[Dict[str, Any]]] = []
+    for i, res in enumerate(results):
+        if isinstance(res, BaseException):
+            print("[MIMI] lesson", i, "failed:", repr(res))
+            res = None
+        lessons.append(res)
+    return lessons
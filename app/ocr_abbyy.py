@@ -1,150 +1,341 @@
 # app/ocr_abbyy.py
-import os, time, base64, requests, xmltodict, re
+import os, io, json, time, base64, tempfile, httpx, re, threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from app import cache
 
 ABBYY_APP_ID       = os.getenv("ABBYY_APP_ID", "")
 ABBYY_APP_PASSWORD = os.getenv("ABBYY_APP_PASSWORD", "")
 ABBYY_LOCATION     = os.getenv("ABBYY_LOCATION", "cloud-eu")  # e.g. cloud-eu, cloud
 OCR_MIN_CONF       = float(os.getenv("OCR_MIN_CONF", "0.85") or 0.85)
+OCR_CONF_POLICY    = os.getenv("OCR_CONF_POLICY", "strict")  # "fast": skip the XML check when the text is substantial
+OCR_FAST_ACCEPT_CHARS = int(os.getenv("OCR_FAST_ACCEPT_CHARS", "500") or 500)
+OCR_RESULT_TTL     = int(os.getenv("OCR_RESULT_TTL", "3600") or 0)  # seconds ocr_result keeps finished text
+OCR_SUBMIT_RPS     = float(os.getenv("OCR_SUBMIT_RPS", "0") or 0)  # max task submissions/s per process; 0 = unpaced
+
+try:
+    import orjson  # task payloads are parsed on every status poll
+except Exception:
+    orjson = None  # type: ignore
+
+_loads = orjson.loads if orjson is not None else json.loads
 
 BASE = f"https://{ABBYY_LOCATION}.ocrsdk.com"
 
-def _auth_header() -> dict:
-    token = base64.b64encode(f"{ABBYY_APP_ID}:{ABBYY_APP_PASSWORD}".encode()).decode()
-    return {"Authorization": f"Basic {token}"}
+# One HTTP/2 client for ABBYY and its result blobs: the submit, every status poll and both downloads
+# share multiplexed keep-alive connections. Transport retries only cover failed connects, so a task
+# submission is never sent twice.
+_client = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+    ),
+    timeout=httpx.Timeout(120.0, connect=15.0),
+    follow_redirects=True,
+)
+# Credentials are fixed for the process lifetime: encode the Basic header once
+_AUTH_HEADER = {"Authorization": "Basic " + base64.b64encode(f"{ABBYY_APP_ID}:{ABBYY_APP_PASSWORD}".encode()).decode()}
 
-def _as_json(resp: requests.Response) -> dict:
+def _local(tag: str) -> str:
+    """Tag name without its {namespace} (ABBYY XML uses a default namespace)."""
+    return tag.rsplit("}", 1)[-1]
+
+def _child(elem, name: str):
+    return next((c for c in elem if _local(c.tag) == name), None)
+
+def _as_json(resp: httpx.Response) -> dict:
     """Handle ABBYY JSON or XML task payloads gracefully."""
     try:
-        return resp.json()
+        return _loads(resp.content)
     except ValueError:
         try:
-            data = xmltodict.parse(resp.text)
+            root = ET.fromstring(resp.content)
             # Typical XML shape: <response><task id="..." status="..."/></response>
-            task = data.get("response", {}).get("task") or {}
+            task = _child(root, "task") if _local(root.tag) == "response" else None
             # Normalize to JSON-ish dict
-            if isinstance(task, dict):
-                task_id = task.get("@id") or task.get("id")
-                status = task.get("@status") or task.get("status")
-                # resultUrls may be a list or single url in XML
-                res = task.get("resultUrls", {}).get("url") if isinstance(task.get("resultUrls"), dict) else None
-                if isinstance(res, list):
-                    result_urls = res
-                elif isinstance(res, str):
-                    result_urls = [res]
-                else:
-                    result_urls = []
-                return {"taskId": task_id, "status": status, "resultUrls": result_urls}
+            if task is not None:
+                def field(name):
+                    el = _child(task, name)
+                    return task.get(name) or (el.text if el is not None else None)
+                # resultUrls may hold one or several <url> elements
+                urls = _child(task, "resultUrls")
+                result_urls = [u.text for u in urls if _local(u.tag) == "url" and u.text] if urls is not None else []
+                return {"taskId": field("id"), "status": field("status"), "resultUrls": result_urls}
         except Exception:
             pass
     raise ValueError("Unexpected ABBYY response format")
 
-def _poll_task(task_id: str, timeout=180):
-    delay = 3.0
+# Running average of task durations per (is_pdf, size bucket), used to time the first status poll
+_task_seconds: dict = {}
+
+def _task_bucket(file_bytes: bytes, is_pdf: bool) -> tuple:
+    return (is_pdf, len(file_bytes).bit_length())  # power-of-two size buckets
+
+def _poll_task(task_id: str, timeout=180, bucket=None):
+    started = time.monotonic()
+    expected = _task_seconds.get(bucket)
+    # Start fast (most images finish within seconds) or just short of the usual duration for this size
+    delay = max(0.5, 0.8 * expected) if expected else 0.5
     waited = 0.0
+    headers = {**_AUTH_HEADER, "Accept": "application/json"}
     while waited < timeout:
-        r = requests.get(
+        time.sleep(delay)
+        waited += delay
+        delay = min(10.0, delay * 1.5)
+        r = _client.get(
             f"{BASE}/v2/getTaskStatus",
             params={"taskId": task_id},
-            headers={**_auth_header(), "Accept": "application/json"},
-            timeout=(15, 120),
+            headers=headers,
         )
+        if r.status_code == 304:
+            continue  # unchanged since the last poll
         r.raise_for_status()
+        if r.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = r.headers["Last-Modified"]
         st = _as_json(r)
         status = st.get("status")
         if status in ("Completed", "ProcessingFailed", "NotEnoughCredits"):
+            if bucket is not None and status == "Completed":
+                took = time.monotonic() - started
+                prev = _task_seconds.get(bucket)
+                _task_seconds[bucket] = took if prev is None else 0.7 * prev + 0.3 * took
             return st
-        time.sleep(delay)
-        waited += delay
-        delay = min(10.0, delay * 1.2)
+        try:
+            hint = float(st.get("requestStatusDelay") or 0) / 1000.0  # ABBYY's own suggestion, in ms
+            if hint > 0:
+                delay = min(10.0, max(0.5, hint))
+        except (TypeError, ValueError):
+            pass
     raise TimeoutError("ABBYY polling timed out")
 
-def _avg_conf_from_xml(xml_text: str) -> float:
+def _download(url: str) -> str:
+    r = _client.get(url)
+    r.raise_for_status()
+    return r.text
+
+_CONF_RE = re.compile(rb'confidence="(\d+(?:\.\d+)?)"')
+_CONF_CARRY = 64  # bytes kept between chunks so a match split across two chunks is still seen
+
+def _conf_scan(chunks, sink=None) -> tuple:
+    """(sum, count) of confidence="NN" values over byte chunks; chunks are copied to sink if given."""
+    total, n, carry = 0.0, 0, b""
+    for chunk in chunks:
+        if sink is not None:
+            sink.write(chunk)
+        buf = carry + chunk
+        last = 0
+        for m in _CONF_RE.finditer(buf):
+            total += float(m.group(1))
+            n += 1
+            last = m.end()
+        carry = buf[max(last, len(buf) - _CONF_CARRY):]
+    return total, n
+
+_WALK_ROOT_CLEAR_EVERY = 1000  # end events between root.clear() calls
+
+def _avg_conf_walk(source):
+    """Fallback for exports without confidence attributes: average charParams confidences, or None."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    total, n, seen = 0.0, 0, 0
+    root = None
+    in_char, pending = False, None  # <confidence> child text, read before its charParams ends
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        tag = _local(elem.tag)
+        if event == "start":
+            if root is None:
+                root = elem
+            if tag == "charParams":
+                in_char, pending = True, None
+            continue
+        if tag == "confidence" and in_char:
+            pending = elem.text
+        elif tag == "charParams":
+            c = elem.get("confidence", pending)
+            if c is not None:
+                try:
+                    total += float(c) / 100.0
+                    n += 1
+                except ValueError:
+                    pass
+            in_char = False
+        # Every finished element is dropped, and the root's list of emptied children with it,
+        # so memory stays flat however long the export is
+        elem.clear()
+        seen += 1
+        if seen % _WALK_ROOT_CLEAR_EVERY == 0 and root is not None:
+            root.clear()
+    return total / n if n else None
+
+def _avg_conf_from_xml(xml_text) -> float:
+    """Mean confidence (0..1) of an ABBYY XML export, given as bytes (preferred) or str."""
     try:
-        # Prefer regex per brief; ABBYY often includes confidence="NN"
-        vals = [float(x) / 100.0 for x in re.findall(r'confidence="(\d+(?:\.\d+)?)"', xml_text)]
-        if vals:
-            return sum(vals) / len(vals)
-        # Fallback: try to average words if present in parsed XML
-        data = xmltodict.parse(xml_text)
-        words = []
-        for page in (data.get("document", {}).get("page") or []):
-            # normalize to list
-            lines = page.get("line") or []
-            if isinstance(lines, dict):
-                lines = [lines]
-            for line in lines:
-                ws = line.get("formatting", {}).get("charParams")
-                if isinstance(ws, list):
-                    words.extend(ws)
-        if words:
-            cs = []
-            for w in words:
-                c = w.get("@confidence") or w.get("confidence")
-                if c is not None:
-                    try: cs.append(float(c) / 100.0)
-                    except: pass
-            if cs:
-                return sum(cs) / len(cs)
+        # Prefer regex per brief; ABBYY often includes confidence="NN". Running mean: no match list
+        xml_bytes = xml_text.encode("utf-8") if isinstance(xml_text, str) else xml_text
+        total, n = _conf_scan((xml_bytes,))
+        if n:
+            return total / n / 100.0
+        conf = _avg_conf_walk(xml_bytes)
+        if conf is not None:
+            return conf
     except Exception:
         pass
     return 1.0  # if no confidences, assume OK
 
-def ocr_file_to_text(file_bytes: bytes, is_pdf: bool, language: str = "French") -> str:
+def _download_conf(url: str) -> float:
+    """
+    _avg_conf_from_xml over a streamed download: the export (tens of MB for long PDFs) is scanned
+    chunk by chunk as it arrives, and only spooled to disk in case the slow fallback is needed.
+    """
+    with _client.stream("GET", url) as r, tempfile.SpooledTemporaryFile(max_size=1 << 20) as spool:
+        r.raise_for_status()
+        total, n = _conf_scan(r.iter_bytes(chunk_size=65536), sink=spool)
+        if n:
+            return total / n / 100.0
+        try:
+            spool.seek(0)
+            conf = _avg_conf_walk(spool)
+            if conf is not None:
+                return conf
+        except Exception:
+            pass
+    return 1.0
+
+_submit_lock = threading.Lock()
+_next_submit = 0.0
+
+def _pace_submit() -> None:
+    """
+    Space task submissions at least 1/OCR_SUBMIT_RPS apart across this process's threads, so a
+    burst of per-page jobs stays under ABBYY's request rate instead of collecting 429s.
+    """
+    global _next_submit
+    if OCR_SUBMIT_RPS <= 0:
+        return
+    with _submit_lock:
+        now = time.monotonic()
+        slot = max(now, _next_submit)
+        _next_submit = slot + 1.0 / OCR_SUBMIT_RPS
+    if slot > now:
+        time.sleep(slot - now)
+
+def ocr_submit(file_bytes: bytes, is_pdf: bool, language: str = "French", image_format: str = "png") -> Optional[str]:
+    """
+    Start an ABBYY task for a PDF (processDocument) or a single image (processImage) and return its
+    task id without waiting. image_format ("png", "jpg", ...) names the upload so ABBYY decodes it.
+    """
+    endpoint = f"{BASE}/v2/processDocument" if is_pdf else f"{BASE}/v2/processImage"
+    if is_pdf:
+        files = {"file": ("file.pdf", file_bytes, "application/pdf")}
+    else:
+        mime = "image/jpeg" if image_format in ("jpg", "jpeg") else f"image/{image_format}"
+        files = {"file": (f"image.{image_format}", file_bytes, mime)}
+    data = {
+        "exportFormats": "txt,xml",   # <-- plural
+        "language": language,
+    }
+    _pace_submit()
+    r = _client.post(
+        endpoint,
+        headers=_AUTH_HEADER,
+        files=files,
+        data=data,
+    )
+    r.raise_for_status()
+    return _as_json(r).get("taskId")
+
+def _fetch_text_conf(st: dict) -> tuple[str, float]:
+    """Download a completed task's text and its average character confidence (per OCR_CONF_POLICY)."""
+    res_urls = st.get("resultUrls") or []
+    txt_url = next((u for u in res_urls if u.lower().endswith(".txt")), None)
+    xml_url = next((u for u in res_urls if u.lower().endswith(".xml")), None)
+
+    if OCR_CONF_POLICY == "fast":
+        # Plenty of recognised text means the scan was readable: the XML is only fetched to
+        # judge short or empty results
+        txt = _download(txt_url) if txt_url else ""
+        short = len(txt.strip()) < OCR_FAST_ACCEPT_CHARS
+        conf = _download_conf(xml_url) if xml_url and short else 1.0
+    else:
+        # The two exports are independent: fetch the XML alongside the text instead of after it
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            conf_future = pool.submit(_download_conf, xml_url) if xml_url else None
+            txt = _download(txt_url) if txt_url else ""
+            conf = conf_future.result() if conf_future else 1.0
+    return txt.strip(), conf
+
+def _fetch_text(st: dict) -> str:
+    """Download a completed task's text, enforcing OCR_MIN_CONF (exit 3 for the supervisor)."""
+    txt, conf = _fetch_text_conf(st)
+    if conf < OCR_MIN_CONF:
+        import sys
+        print("__OCR_CONFIDENCE_FAIL__", json.dumps({"confidence": conf}), file=sys.stderr)
+        sys.exit(3)  # <-- per brief: let supervisor catch & auto-fix
+
+    return txt
+
+def ocr_result(task_id: str) -> dict:
     """
-    Sends either a PDF (processDocument) or a single image (processImage) to ABBYY.
+    One non-blocking status check: {"status": ...}, plus "text" once the task has finished
+    ("" for failed tasks). Finished results are cached, so repeated checks cost one Redis read.
+    Unlike the blocking ocr_file_to_text this never exits the process: a scan below OCR_MIN_CONF
+    comes back as {"status": "LowConfidence", "text": "", "confidence": ...}.
+    """
+    key = f"ocr:{task_id}"
+    done = cache.get_json(key)
+    if done is not None:
+        return done
+    r = _client.get(
+        f"{BASE}/v2/getTaskStatus",
+        params={"taskId": task_id},
+        headers={**_AUTH_HEADER, "Accept": "application/json"},
+    )
+    r.raise_for_status()
+    st = _as_json(r)
+    status = st.get("status")
+    if status == "Completed":
+        txt, conf = _fetch_text_conf(st)
+        if conf < OCR_MIN_CONF:
+            done = {"status": "LowConfidence", "text": "", "confidence": conf}
+        else:
+            done = {"status": status, "text": txt}
+    elif status in ("ProcessingFailed", "NotEnoughCredits", "Deleted"):
+        done = {"status": status, "text": ""}
+    else:
+        return {"status": status}
+    cache.set_json(key, done, OCR_RESULT_TTL)
+    return done
+
+def ocr_file_to_text(file_bytes: bytes, is_pdf: bool, language: str = "French", image_format: str = "png",
+                     exit_on_low_conf: bool = True) -> str:
+    """
+    Blocking OCR: ocr_submit, poll until ABBYY finishes, then download the text.
     Returns plain text if OK and confidence >= OCR_MIN_CONF; else signals supervisor fail (exit 3) or returns "" if not configured.
+    exit_on_low_conf=False returns "" for a low-confidence result instead, for callers OCR'ing parts of a
+    document (single PDF pages) that keep their own text as the fallback.
     """
     if not (ABBYY_APP_ID and ABBYY_APP_PASSWORD):
         # No ABBYY configured; skip so pipeline can continue
         return ""
 
     try:
-        endpoint = f"{BASE}/v2/processDocument" if is_pdf else f"{BASE}/v2/processImage"
-        files = {"file": ("file.pdf" if is_pdf else "image.png", file_bytes)}
-        data = {
-            "exportFormats": "txt,xml",   # <-- plural
-            "language": language,
-        }
-        r = requests.post(
-            endpoint,
-            headers=_auth_header(),
-            files=files,
-            data=data,
-            timeout=(15, 120),
-        )
-        r.raise_for_status()
-        resp = _as_json(r)
-        task_id = resp.get("taskId")
+        task_id = ocr_submit(file_bytes, is_pdf, language, image_format)
         if not task_id:
             return ""
 
-        st = _poll_task(task_id)
+        st = _poll_task(task_id, bucket=_task_bucket(file_bytes, is_pdf))
         if st.get("status") != "Completed":
             return ""
-
-        # Download result URLs
-        res_urls = st.get("resultUrls") or []
-        txt_url = next((u for u in res_urls if u.lower().endswith(".txt")), None)
-        xml_url = next((u for u in res_urls if u.lower().endswith(".xml")), None)
-
-        txt = ""
-        conf = 1.0
-        if txt_url:
-            t = requests.get(txt_url, timeout=(15, 120))
-            t.raise_for_status()
-            txt = t.text
-
-        if xml_url:
-            x = requests.get(xml_url, timeout=(15, 120))
-            x.raise_for_status()
-            conf = _avg_conf_from_xml(x.text)
-
+        if exit_on_low_conf:
+            return _fetch_text(st)
+        txt, conf = _fetch_text_conf(st)
         if conf < OCR_MIN_CONF:
-            import sys, json as _json
-            print("__OCR_CONFIDENCE_FAIL__", _json.dumps({"confidence": conf}), file=sys.stderr)
-            sys.exit(3)  # <-- per brief: let supervisor catch & auto-fix
-
-        return txt.strip()
+            print(f"[OCR][ABBYY] low confidence {conf:.2f}; discarding result")
+            return ""
+        return txt
     except SystemExit:
         raise
     except Exception as e:
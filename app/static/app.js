@@ -348,24 +348,25 @@ $("#btnGenImgs").addEventListener("click", async () => {
     const res = await fetch("/api/v2/generate_images", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ image_prompts: lastSyncLesson.image_prompts }),
+      body: JSON.stringify({ image_prompts: lastSyncLesson.image_prompts, store: true }),
     });
     const data = await res.json();
     if (!res.ok || !data.ok) throw new Error(data.error || res.statusText);
 
     (data.images || []).forEach((im, idx) => {
-      if (im.data_url) {
+      const src = im.url || im.data_url;
+      if (src) {
         const btn = document.createElement("button");
         btn.className = "image-tab";
         const img = document.createElement("img");
-        img.src = im.data_url;
+        img.src = src;
         img.alt = im.id || "img";
         btn.appendChild(img);
         btn.onclick = () => {
-          selectedImage = im.data_url;
+          selectedImage = src;
           imagePreviewEl.innerHTML = "";
           const big = document.createElement("img");
-          big.src = im.data_url;
+          big.src = src;
           big.alt = im.id || "img";
           imagePreviewEl.appendChild(big);
           [...imageTabsEl.querySelectorAll(".image-tab")].forEach((t) => t.classList.remove("active"));
@@ -380,7 +381,7 @@ $("#btnGenImgs").addEventListener("click", async () => {
         imageTabsEl.appendChild(err);
       }
     });
-    lastSyncLesson.images = (data.images || []).map(im => ({...im, url: im.data_url}));
+    lastSyncLesson.images = (data.images || []).map(im => ({...im, url: im.url || im.data_url}));
     renderLessonCards(lastSyncLesson);
     setStatus("✅ Images prêtes");
   } catch (e) {
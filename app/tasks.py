@@ -1,13 +1,20 @@
 # app/tasks.py
-import os, requests, logging, re, uuid
+import os, requests, logging, re, uuid, time, threading, base64, hashlib, hmac, json, shutil, tempfile, math, asyncio, functools
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional
 from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from flask import Blueprint, request, jsonify
+from celery.exceptions import Retry as TaskRetry
+from celery.signals import worker_process_init
 from celery.utils.log import get_task_logger
 
+from app import cache
+
 # ---- Celery (use the shared app) ----
 try:
     from app.celery_app import celery_app  # single source of truth
@@ -25,30 +32,151 @@ bp = Blueprint("tasks", __name__)
 # ---- Supabase ----
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
-supabase = None
-if SUPABASE_URL and SUPABASE_SERVICE_KEY:
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20") or 20)             # PostgREST connections
+SUPABASE_KEEPALIVE_S = float(os.getenv("SUPABASE_KEEPALIVE_S", "60") or 60)      # idle socket lifetime
+
+def _pool_postgrest(client) -> None:
+    """
+    postgrest-py keeps one httpx session per client, but with httpx defaults idle sockets are
+    dropped after 5 s, so most queries pay a new TCP+TLS handshake. Keep them warm instead.
+    """
+    import httpx
+    from postgrest.utils import SyncClient
+
+    old = client.postgrest.session
+    transport = httpx.HTTPTransport(
+        http2=True,
+        retries=1,  # connect retries only
+        limits=httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_POOL_SIZE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_S,
+        ),
+    )
+    client.postgrest.session = SyncClient(
+        base_url=old.base_url,
+        headers=old.headers,
+        timeout=old.timeout,
+        follow_redirects=True,
+        transport=transport,
+    )
+    old.close()
+
+def _create_supabase():
+    if not (SUPABASE_URL and SUPABASE_SERVICE_KEY):
+        return None
     try:
         from supabase import create_client
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
     except Exception as e:
         py_logger.warning("[SUPABASE] client init failed: %r", e)
+        return None
+    try:
+        _pool_postgrest(client)
+    except Exception as e:
+        py_logger.warning("[SUPABASE] keeping default PostgREST session: %r", e)
+    return client
+
+supabase = _create_supabase()
+
+@worker_process_init.connect
+def _init_worker_clients(**_):
+    """
+    Prefork children inherit the parent's HTTP clients (and their pooled sockets).
+    Build fresh Supabase/OpenAI clients once per worker process and share them across tasks.
+    """
+    global supabase
+    supabase = _create_supabase()
+    from app import mimi
+    mimi.reset_openai_client()
 
 # ---- OpenAI (env) ----
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")              # used indirectly by mimi
 OPENAI_MODEL = os.getenv("OPENAI_MODEL_TEXT", "gpt-4o-mini")  # kept for compatibility
 
+# ---- OCR (env) ----
+OCR_PARALLELISM = int(os.getenv("OCR_PARALLELISM", "8") or 8)         # concurrent ABBYY page jobs
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "40") or 40)  # below this a page is OCR'd
+OCR_BATCH_RATIO = float(os.getenv("OCR_BATCH_RATIO", "0.5") or 0.5)    # OCR whole PDF at this share
+PDF_DENSE_PAGE_CHARS = int(os.getenv("PDF_DENSE_PAGE_CHARS", "1500") or 1500)  # fast path threshold
+OCR_MERGE_TIFF = os.getenv("OCR_MERGE_TIFF", "0") == "1"                 # one TIFF upload for OCR pages
+OCR_DPI = int(os.getenv("OCR_DPI", "150") or 150)                      # page render resolution for OCR
+OCR_JPEG_QUALITY = 75
+PDF_STORE_SHRINK_BYTES = 64 * 1024 * 1024                              # empty MuPDF store after this
+PDF_PROCESS_WORKERS = int(os.getenv("PDF_PROCESS_WORKERS", "0") or 0)  # >0: read big PDFs across processes
+PDF_PARALLEL_MIN_PAGES = 64                                            # smaller PDFs stay serial
+PDF_PARALLEL_CHUNK = 50                                                # pages per process task
+
 # ---- Helpers ----
+_WORD_RE = re.compile(r"[A-Za-zÀ-ÖØ-öø-ÿ]+")
+_EMAIL_RE = re.compile(r"[\w\.-]+@[\w\.-]+")
+_PHONE_RE = re.compile(r"\+?\d[\d\s-]{7,}\d")
+_STOPWORDS = frozenset({
+    "le", "la", "les", "un", "une", "de", "des", "et", "en", "du",
+    "que", "qui", "pour", "dans", "est", "sur", "au", "aux", "ce",
+    "ces", "se", "sa", "son", "ses", "avec", "par", "plus", "pas",
+})
+
+# ---- Auth ----
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")  # when set, HS256 signatures are verified
+_AUTH_CACHE_TTL = 300
+_AUTH_CACHE_MAX = 1024
+_auth_cache: dict = {}  # token -> (expires_at, user_id)
+_auth_lock = threading.Lock()
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+def _token_payload(token: str) -> Optional[dict]:
+    """Decode a Supabase JWT without PyJWT; None on a bad signature/expiry when the secret is known."""
+    header_b64, payload_b64, sig_b64 = token.split(".")
+    payload = json.loads(_b64url_decode(payload_b64))
+    if SUPABASE_JWT_SECRET:
+        if json.loads(_b64url_decode(header_b64)).get("alg") != "HS256":
+            return None
+        signed = f"{header_b64}.{payload_b64}".encode("ascii")
+        expected = hmac.new(SUPABASE_JWT_SECRET.encode("utf-8"), signed, hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64url_decode(sig_b64)):
+            return None
+        if payload.get("exp") is not None and payload["exp"] < time.time():
+            return None
+    return payload
+
 def _get_user_id_from_auth() -> Optional[str]:
     auth = request.headers.get("Authorization", "")
     if not auth.startswith("Bearer "):
         return None
     token = auth.split(" ", 1)[1]
+    now = time.time()
+    with _auth_lock:
+        hit = _auth_cache.get(token)
+    if hit and hit[0] > now:
+        return hit[1]
     try:
-        import jwt  # requires PyJWT
-        payload = jwt.decode(token, options={"verify_signature": False})
-        return payload.get("sub") or payload.get("user_id")
+        payload = _token_payload(token) or {}
+        user_id = payload.get("sub") or payload.get("user_id")
+        expires_at = min(now + _AUTH_CACHE_TTL, float(payload.get("exp") or now + _AUTH_CACHE_TTL))
     except Exception:
         return None
+    if user_id:
+        with _auth_lock:
+            if len(_auth_cache) >= _AUTH_CACHE_MAX:
+                _auth_cache.clear()
+            _auth_cache[token] = (expires_at, user_id)  # never kept past the token's own exp
+    return user_id
+
+# Bound once: the public-object base never changes while the process runs
+_STORAGE_PUBLIC_PREFIX = SUPABASE_URL.rstrip("/").replace(
+    "supabase.co", "supabase.co/storage/v1/object/public"
+) + "/"
+
+# Keep-alive session for Storage downloads; 429/5xx from Supabase are retried with backoff (Retry-After honoured)
+_storage_http = requests.Session()
+_storage_http.mount("https://", HTTPAdapter(
+    pool_connections=SUPABASE_POOL_SIZE,
+    pool_maxsize=SUPABASE_POOL_SIZE,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)),
+))
 
 def _public_storage_url(path: str) -> str:
     """
@@ -56,25 +184,47 @@ def _public_storage_url(path: str) -> str:
     Accepts either "bucket/path/to/file" or just "path" if your path already starts with the bucket.
     Preserves existing % encodings and encodes spaces safely.
     """
-    base = SUPABASE_URL.rstrip("/").replace(
-        "supabase.co", "supabase.co/storage/v1/object/public"
-    )
     # Avoid double-encoding existing %xx
-    safe_path = quote(path.lstrip("/"), safe="/%")
-    return f"{base}/{safe_path}"
+    return _STORAGE_PUBLIC_PREFIX + quote(path.lstrip("/"), safe="/%")
+
+# RAM-backed scratch space for downloads: MuPDF still gets a real path to map, without disk I/O
+DOWNLOAD_TMP_DIR = os.getenv("DOWNLOAD_TMP_DIR", "/dev/shm")
+
+def _download_tmp_dir(size: int) -> Optional[str]:
+    """
+    DOWNLOAD_TMP_DIR when it exists and has room for a file of size bytes (twice over, since
+    tmpfs is shared and counts against memory); None (the system temp dir) otherwise,
+    including when the size is unknown.
+    """
+    if not DOWNLOAD_TMP_DIR or size <= 0 or not os.path.isdir(DOWNLOAD_TMP_DIR):
+        return None
+    try:
+        return DOWNLOAD_TMP_DIR if shutil.disk_usage(DOWNLOAD_TMP_DIR).free > 2 * size else None
+    except OSError:
+        return None
+
+def _download_to_path(url: str, suffix: str = "") -> str:
+    """Stream a Storage object into a temp file and return its path (caller deletes it)."""
+    with _storage_http.get(url, timeout=60, stream=True) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True  # undo gzip/deflate transfer encoding while copying
+        size = int(r.headers.get("Content-Length") or 0)
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False, dir=_download_tmp_dir(size)) as tmp:
+            try:
+                shutil.copyfileobj(r.raw, tmp, 1 << 20)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+    return tmp.name
 
 def extract_image_descriptions(text: str, max_items: int = 5) -> list[str]:
     """Return key nouns/scene hints from OCR text using simple frequency analysis."""
     if not text:
         return []
     # Grab alphabetic words (including accents)
-    words = re.findall(r"[A-Za-zÀ-ÖØ-öø-ÿ]+", text.lower())
-    stopwords = {
-        "le", "la", "les", "un", "une", "de", "des", "et", "en", "du",
-        "que", "qui", "pour", "dans", "est", "sur", "au", "aux", "ce",
-        "ces", "se", "sa", "son", "ses", "avec", "par", "plus", "pas",
-    }
-    words = [w for w in words if w not in stopwords and len(w) > 2]
+    words = _WORD_RE.findall(text.lower())
+    words = [w for w in words if w not in _STOPWORDS and len(w) > 2]
     if not words:
         return []
     counts = Counter(words)
@@ -89,10 +239,312 @@ def derive_topic_from_text(text: str, max_words: int = 3) -> tuple[str, list[str
 
 def redact_sensitive(text: str) -> str:
     """Redact simple sensitive patterns such as emails and phone numbers."""
-    text = re.sub(r"[\w\.-]+@[\w\.-]+", "[REDACTED_EMAIL]", text)
-    text = re.sub(r"\+?\d[\d\s-]{7,}\d", "[REDACTED_PHONE]", text)
+    text = _EMAIL_RE.sub("[REDACTED_EMAIL]", text)
+    text = _PHONE_RE.sub("[REDACTED_PHONE]", text)
     return text
 
+# Whitespace MuPDF emits in text layers (incl. French non-breaking/thin spaces before ; : ! ?)
+_PAGE_WS_CHARS = " \t\n\r\f\v\xa0\u2009\u202f"
+
+def _visible_chars(raw: str) -> int:
+    """Non-whitespace length, counted in C (str.count) instead of building a stripped copy per page."""
+    return len(raw) - sum(map(raw.count, _PAGE_WS_CHARS))
+
+def _is_mostly_image(raw: str) -> bool:
+    """A page whose text layer has fewer than OCR_MIN_PAGE_CHARS visible characters is treated as scanned."""
+    return len(raw) < OCR_MIN_PAGE_CHARS or _visible_chars(raw) < OCR_MIN_PAGE_CHARS
+
+@functools.lru_cache(maxsize=None)
+def _pdf_text_flags() -> int:
+    """
+    Plain-text extraction flags: PyMuPDF's "text" defaults minus ligature preservation
+    (expanded ligatures read better downstream) and image placeholders (unused here).
+    Media-box clipping stays on so off-page junk is ignored.
+    """
+    import fitz  # type: ignore
+
+    flags = getattr(fitz, "TEXTFLAGS_TEXT", None)
+    if flags is None:
+        return 0
+    return flags & ~fitz.TEXT_PRESERVE_LIGATURES & ~fitz.TEXT_PRESERVE_IMAGES
+
+def _looks_text_native(doc) -> bool:
+    """Sample the first, middle and last pages; dense text on all of them means no OCR is needed."""
+    n = doc.page_count
+    if n == 0:
+        return False
+    flags = _pdf_text_flags()
+    sample = sorted({0, n // 2, n - 1})
+    visible = [_visible_chars(doc[i].get_text("text", flags=flags) or "") for i in sample]
+    return min(visible) >= PDF_DENSE_PAGE_CHARS
+
+def _classify_pages(doc, batch_at: Optional[int] = None, start: int = 0) -> list[tuple[int, str, bool]]:
+    """
+    Serially read each page's text layer; returns (index, raw_text, needs_ocr).
+    With batch_at, stop as soon as that many pages need OCR: the whole PDF is going
+    to ABBYY anyway, so the text layer of the remaining pages would be wasted work.
+    """
+    flags = _pdf_text_flags()
+    pages = []
+    ocr_count = 0
+    for i in range(start, doc.page_count):
+        try:
+            raw = doc[i].get_text("text", flags=flags) or ""
+        except Exception:
+            raw = ""
+        needs_ocr = _is_mostly_image(raw)
+        pages.append((i, raw, needs_ocr))
+        ocr_count += needs_ocr
+        if batch_at is not None and ocr_count >= batch_at:
+            break
+    return pages
+
+def _extract_range(path: str, start: int, end: int) -> list[str]:
+    """Process-pool task: open the PDF at path and return the raw text of pages [start, end)."""
+    import fitz  # type: ignore
+
+    fitz.TOOLS.mupdf_display_errors(False)
+    flags = _pdf_text_flags()
+    doc = fitz.open(path, filetype="pdf")
+    try:
+        texts = []
+        for i in range(start, end):
+            try:
+                texts.append(doc[i].get_text("text", flags=flags) or "")
+            except Exception:
+                texts.append("")
+        return texts
+    finally:
+        doc.close()
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+def _parallel_page_texts(path: str, page_count: int) -> Optional[list[str]]:
+    """
+    Read every page's text layer in PDF_PARALLEL_CHUNK-page shards across PDF_PROCESS_WORKERS
+    processes; None when disabled, the PDF is small, or no pool can be started (Celery's
+    default prefork children are daemonic and may not fork, so run the worker with
+    -P threads/solo to use this).
+    """
+    global _pdf_pool
+    if PDF_PROCESS_WORKERS <= 0 or page_count <= PDF_PARALLEL_MIN_PAGES:
+        return None
+    try:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=min(PDF_PROCESS_WORKERS, os.cpu_count() or 1))
+        futures = [
+            _pdf_pool.submit(_extract_range, path, start, min(start + PDF_PARALLEL_CHUNK, page_count))
+            for start in range(0, page_count, PDF_PARALLEL_CHUNK)
+        ]
+        return [text for f in futures for text in f.result()]
+    except Exception as e:
+        logger.warning("[JOB] parallel PDF read failed, reading serially: %r", e)
+        return None
+
+def _join_pages(parts: list[str]) -> str:
+    """
+    Join page texts with blank lines, dropping empty pages.
+    A single str.join is already one sizing pass + one copy; round-tripping through
+    UTF-8 bytes would only add encode/decode copies, so this stays on str.
+    """
+    return "\n\n".join(t for t in (p.strip() for p in parts) if t)
+
+def _render_pages(doc, page_numbers: list[int]) -> list[tuple[int, bytes]]:
+    """
+    Rasterize the given pages to grayscale JPEG (OCR_DPI) for OCR — a fraction of the
+    upload size and encode time of colour PNG, with no real accuracy loss on Latin text.
+    MuPDF keeps rendered resources in its global store, which only grows inside long-lived
+    Celery workers; shrink it whenever ~PDF_STORE_SHRINK_BYTES have been rendered.
+    """
+    import fitz  # type: ignore
+
+    out = []
+    rendered = 0
+    for i in page_numbers:
+        pix = doc[i].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+        rendered += pix.size
+        out.append((i, pix.tobytes("jpg", jpg_quality=OCR_JPEG_QUALITY)))
+        del pix
+        if rendered >= PDF_STORE_SHRINK_BYTES:
+            fitz.TOOLS.store_shrink(100)
+            rendered = 0
+    return out
+
+def _render_pages_tiff(doc, page_numbers: list[int]) -> bytes:
+    """Stack the given pages into one multi-page grayscale TIFF (LZW) for a single ABBYY upload."""
+    import io
+    import fitz  # type: ignore
+    from PIL import Image
+
+    frames = []
+    for i in page_numbers:
+        pix = doc[i].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+        frames.append(Image.frombytes("L", (pix.width, pix.height), pix.samples))
+        del pix
+    fitz.TOOLS.store_shrink(100)
+    buf = io.BytesIO()
+    frames[0].save(buf, format="TIFF", save_all=True, append_images=frames[1:], compression="tiff_lzw")
+    return buf.getvalue()
+
+def extract_text_from_pdf(src: str | bytes, language: str = "French") -> str:
+    """
+    Extract text from a PDF (file path or bytes) with PyMuPDF, falling back to ABBYY for image-only pages.
+    Given a path, MuPDF reads the file directly instead of holding a second in-memory copy.
+    - Mostly scanned (>= OCR_BATCH_RATIO of pages): send the whole PDF to ABBYY once.
+    - Otherwise: rasterize just the OCR pages and run them concurrently (OCR_PARALLELISM),
+      or, with OCR_MERGE_TIFF=1, upload them together as one multi-page TIFF.
+    Page order is preserved; a page keeps its raw text if OCR returns nothing or falls below
+    OCR_MIN_CONF (blank pages, separators and figures often do), so one page never aborts the job.
+    """
+    import fitz  # type: ignore
+    from app import ocr_abbyy
+
+    fitz.TOOLS.mupdf_display_errors(False)  # per-page MuPDF warnings are just log noise here
+    def open_doc():
+        return fitz.open(src, filetype="pdf") if isinstance(src, str) else fitz.open(stream=src, filetype="pdf")
+
+    doc = open_doc()
+    try:
+        page_count = doc.page_count
+        native = _looks_text_native(doc)
+        texts = _parallel_page_texts(src, page_count) if isinstance(src, str) else None
+        if native:
+            # Born-digital PDF: read every page, no per-page OCR checks
+            if texts is None:
+                flags = _pdf_text_flags()
+                texts = [page.get_text("text", flags=flags) or "" for page in doc]
+            return _join_pages(texts)
+        batch_at = max(1, math.ceil(OCR_BATCH_RATIO * page_count))
+        if texts is not None:
+            pages = [(i, raw, _is_mostly_image(raw)) for i, raw in enumerate(texts)]
+        else:
+            pages = _classify_pages(doc, batch_at=batch_at)
+        ocr_pages = [i for i, _, needs_ocr in pages if needs_ocr]
+        batch = bool(pages) and len(ocr_pages) >= batch_at
+        merge = not batch and OCR_MERGE_TIFF and len(ocr_pages) > 1
+        tiff = _render_pages_tiff(doc, ocr_pages) if merge else None
+        ocr_items = [] if batch or merge else _render_pages(doc, ocr_pages)
+    finally:
+        doc.close()
+    parts = [raw for _, raw, _ in pages]
+
+    if batch:
+        # One document job instead of N page uploads; ABBYY splits pages itself
+        if isinstance(src, str):
+            with open(src, "rb") as f:
+                src = f.read()
+        text = ocr_abbyy.ocr_file_to_text(src, is_pdf=True, language=language, exit_on_low_conf=False)
+        logger.info("[JOB] %d+ of %d PDF pages need OCR (stopped scanning at page %d); sent whole PDF to ABBYY",
+                    len(ocr_pages), page_count, len(pages))
+        if not text and len(pages) < page_count:
+            # Rare: ABBYY gave nothing back, so read the text layer of the pages we skipped
+            doc = open_doc()
+            try:
+                parts += [raw for _, raw, _ in _classify_pages(doc, start=len(pages))]
+            finally:
+                doc.close()
+        return text or _join_pages(parts)
+
+    if tiff is not None:
+        # All OCR pages in one upload; ABBYY separates pages with form feeds
+        text = ocr_abbyy.ocr_file_to_text(
+            tiff, is_pdf=False, language=language, image_format="tiff", exit_on_low_conf=False
+        )
+        ocr_parts = text.split("\f") if text else []
+        if len(ocr_parts) == len(ocr_pages):
+            for i, ocr_text in zip(ocr_pages, ocr_parts):
+                parts[i] = ocr_text.strip() or parts[i]
+        elif text:
+            logger.warning("[JOB] ABBYY returned %d page(s) for %d OCR pages; keeping text unsplit",
+                           len(ocr_parts), len(ocr_pages))
+            parts[ocr_pages[0]] = text
+        logger.info("[JOB] OCR'd %d/%d PDF pages via one ABBYY TIFF upload", len(ocr_pages), len(pages))
+
+    if ocr_items:
+        workers = max(1, min(OCR_PARALLELISM, len(ocr_items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                lambda item: ocr_abbyy.ocr_file_to_text(
+                    item[1], is_pdf=False, language=language, image_format="jpg", exit_on_low_conf=False
+                ),
+                ocr_items,
+            )
+            for (i, _), ocr_text in zip(ocr_items, results):
+                parts[i] = ocr_text or parts[i]
+        logger.info("[JOB] OCR'd %d/%d PDF pages via ABBYY", len(ocr_items), len(pages))
+    return _join_pages(parts)
+
+def extract_text_from_pdf_bytes(pdf_bytes: bytes, language: str = "French") -> str:
+    """In-memory variant of extract_text_from_pdf."""
+    return extract_text_from_pdf(pdf_bytes, language=language)
+
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "4") or 4)  # vision calls in flight per job
+VISION_MAX_PAGES = int(os.getenv("VISION_MAX_PAGES", "10") or 10)     # PDF pages sent to vision
+
+_IMAGE_MIME = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp", ".gif": "image/gif"}
+
+def _vision_images(file_bytes: bytes, ext: str) -> list[tuple[str, bytes]]:
+    """
+    (mime, bytes) inputs for the vision model. Vision takes images, not PDFs, so a PDF is
+    rasterized page by page (first VISION_MAX_PAGES) like the ABBYY page path.
+    """
+    if ext != ".pdf":
+        return [(_IMAGE_MIME.get(ext, "image/png"), file_bytes)]
+    import fitz  # type: ignore
+
+    doc = fitz.open(stream=file_bytes, filetype="pdf")
+    try:
+        return [("image/jpeg", jpg) for _, jpg in _render_pages(doc, list(range(min(doc.page_count, VISION_MAX_PAGES))))]
+    finally:
+        doc.close()
+
+async def _vision_describe_many(images: list[tuple[str, bytes]]) -> list[str]:
+    """Describe every image concurrently (VISION_CONCURRENCY at a time), retrying 429s/5xx with jitter."""
+    from app import mimi
+
+    client = mimi._async_openai_client()
+    sem = asyncio.Semaphore(VISION_CONCURRENCY)
+    model = os.getenv("OPENAI_MODEL_VISION", "gpt-4o-mini")
+
+    async def describe(mime: str, data: bytes) -> str:
+        url = f"data:{mime};base64," + base64.b64encode(data).decode("ascii")
+        for attempt in range(mimi.OPENAI_RETRIES + 1):
+            try:
+                async with sem:
+                    resp = await client.responses.create(
+                        model=model,
+                        input=[
+                            {
+                                "role": "user",
+                                "content": [
+                                    {
+                                        "type": "input_text",
+                                        "text": "Extract any visible text or briefly describe the scene in French.",
+                                    },
+                                    {"type": "input_image", "image_url": url},
+                                ],
+                            }
+                        ],
+                    )
+                return getattr(resp, "output_text", "") or ""
+            except Exception as e:
+                if attempt >= mimi.OPENAI_RETRIES:
+                    logger.warning("[JOB] vision call failed: %r", e)
+                    return ""
+                await asyncio.sleep(mimi._backoff(attempt))
+        return ""
+
+    return list(await asyncio.gather(*(describe(mime, data) for mime, data in images)))
+
+async def _vision_describe_all(images: list[tuple[str, bytes]]) -> list[str]:
+    """asyncio.run() entry point: the loop is thrown away afterwards, so close its client with it."""
+    from app import mimi
+
+    try:
+        return await _vision_describe_many(images)
+    finally:
+        await mimi.close_async_openai_client()
+
 def _vision_ocr_fallback(file_bytes: bytes, ext: str) -> str:
     """Try to OCR or describe the image/PDF using pytesseract or OpenAI vision."""
     try:
@@ -105,11 +557,13 @@ def _vision_ocr_fallback(file_bytes: bytes, ext: str) -> str:
         if ext == ".pdf":
             try:
                 doc = fitz.open(stream=file_bytes, filetype="pdf")
-                for page in doc:
-                    pix = page.get_pixmap()
-                    img = Image.open(io.BytesIO(pix.tobytes("png")))
-                    text += pytesseract.image_to_string(img, lang="fra") + "\n"
-                doc.close()
+                try:
+                    for page in doc:
+                        pix = page.get_pixmap()
+                        img = Image.open(io.BytesIO(pix.tobytes("png")))
+                        text += pytesseract.image_to_string(img, lang="fra") + "\n"
+                finally:
+                    doc.close()
             except Exception as e:
                 logger.warning("[JOB] pytesseract PDF fallback failed: %r", e)
         else:
@@ -120,35 +574,54 @@ def _vision_ocr_fallback(file_bytes: bytes, ext: str) -> str:
     except Exception as e:
         logger.warning("[JOB] pytesseract fallback failed: %r", e)
 
-    if OPENAI_API_KEY:
+    from app import mimi
+    if mimi.OPENAI_API_KEY and mimi.AsyncOpenAI is not None:
         try:
-            import base64
-            from openai import OpenAI
-
-            client = OpenAI(api_key=OPENAI_API_KEY)
-            b64 = base64.b64encode(file_bytes).decode("utf-8")
-            resp = client.responses.create(
-                model=os.getenv("OPENAI_MODEL_VISION", "gpt-4o-mini"),
-                input=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "input_text",
-                                "text": "Extract any visible text or briefly describe the scene in French.",
-                            },
-                            {"type": "input_image", "image_base64": b64},
-                        ],
-                    }
-                ],
-            )
-            return getattr(resp, "output_text", "")
+            images = _vision_images(file_bytes, ext)
+            texts = asyncio.run(_vision_describe_all(images))
+            return _join_pages(texts)
         except Exception as e:
             logger.warning("[JOB] OpenAI vision fallback failed: %r", e)
 
     return ""
 
 # ---- API: create lesson job ----
+MAX_QUEUED_LESSONS = int(os.getenv("MAX_QUEUED_LESSONS", "0") or 0)  # 429 above this backlog; 0 disables
+QUEUE_BUSY_RETRY_AFTER = 5                                             # seconds clients are told to back off
+_QUEUE_DEPTH_TTL = 5.0
+_queue_depth = (0.0, 0)  # (checked_at, waiting jobs)
+_queue_depth_refreshing = False  # one request asks the broker; the rest serve the cached depth
+_queue_depth_lock = threading.Lock()
+_QUEUE_DEPTH_CONNECT_TIMEOUT = 1.0  # seconds; a down broker must not stall admission
+
+def _lesson_queue_depth() -> int:
+    """
+    Jobs waiting on the broker's default queue, refreshed at most every _QUEUE_DEPTH_TTL seconds.
+    A passive queue_declare is one cheap broker round-trip (LLEN on Redis), unlike a worker
+    inspect() broadcast; broker trouble reads as 0 so admission never blocks on it.
+    The lock only guards the cached tuple: the broker call runs outside it, in one request at a time.
+    """
+    global _queue_depth, _queue_depth_refreshing
+    with _queue_depth_lock:
+        checked_at, depth = _queue_depth
+        if _queue_depth_refreshing or time.monotonic() - checked_at < _QUEUE_DEPTH_TTL:
+            return depth
+        _queue_depth_refreshing = True
+    try:
+        with celery_app.connection_for_write(connect_timeout=_QUEUE_DEPTH_CONNECT_TIMEOUT) as conn:
+            # No reconnect loop: without this kombu retries for ~2s before raising
+            conn.ensure_connection(max_retries=0, timeout=_QUEUE_DEPTH_CONNECT_TIMEOUT)
+            queue = celery_app.conf.task_default_queue
+            depth = conn.default_channel.queue_declare(queue=queue, passive=True).message_count
+    except Exception as e:
+        py_logger.warning("[API] queue depth check failed: %r", e)
+        depth = 0
+    finally:
+        with _queue_depth_lock:
+            _queue_depth = (time.monotonic(), depth)
+            _queue_depth_refreshing = False
+    return depth
+
 @bp.route("/api/lessons", methods=["POST"])
 def api_lessons():
     body = request.get_json(silent=True) or {}
@@ -164,53 +637,145 @@ def api_lessons():
     except (ValueError, TypeError):
         return jsonify(ok=False, error="child_id must be a valid UUID"), 400
 
-    # Optional auth check
+    # Shed load before touching the DB: a deep backlog only means every lesson finishes late
+    if MAX_QUEUED_LESSONS > 0 and _lesson_queue_depth() >= MAX_QUEUED_LESSONS:
+        resp = jsonify(ok=False, error="busy", retry_after=QUEUE_BUSY_RETRY_AFTER)
+        resp.headers["Retry-After"] = str(QUEUE_BUSY_RETRY_AFTER)
+        return resp, 429
+
+    lesson_id = str(uuid.uuid4())
+
+    # Optional auth check: ownership check + row insert in one Postgres call (no TOCTOU window)
     user_id = _get_user_id_from_auth()
+    if not user_id and request.headers.get("Authorization"):
+        # A token was sent but did not verify: reject rather than fall back to anonymous
+        return jsonify(ok=False, error="Invalid or expired token"), 401
+    created = False
     if user_id and supabase:
-        child = supabase.table("children").select("id,parent_id").eq("id", child_id).execute()
-        if not child.data:
-            return jsonify(ok=False, error="Child not found"), 404
-        if child.data[0].get("parent_id") != user_id:
-            return jsonify(ok=False, error="Not authorized for this child"), 403
-
-    # Create lesson row
-    lesson_rec = {
-        "child_id": child_id,
-        "uploaded_file_path": file_path,  # ensure this column exists
-        "status": "processing"
-    }
-    if supabase:
-        lesson = supabase.table("lessons").insert(lesson_rec).execute()
-        lesson_id = lesson.data[0]["id"]
-    else:
-        # Use a UUID string locally to mirror production IDs
-        lesson_id = str(uuid.uuid4())
+        try:
+            supabase.rpc("create_lesson_if_authorized", {
+                "p_id": lesson_id,
+                "p_child": child_id,
+                "p_path": file_path,
+                "p_user": user_id,
+            }).execute()
+            created = True
+        except Exception as e:
+            code = getattr(e, "code", None)
+            if code == "P0002":
+                return jsonify(ok=False, error="Child not found"), 404
+            if code in ("42501", "22P02"):  # 22P02: p_user is not a uuid, so it owns nothing
+                return jsonify(ok=False, error="Not authorized for this child"), 403
+            py_logger.warning("[API] create_lesson_if_authorized failed: %r", e)
+            return jsonify(ok=False, error="Could not create lesson"), 500
+    elif supabase:
+        # Anonymous: create the row here so a bad child_id is a 404 now, not a job that dies
+        # in the worker while the client polls a lesson that never appears
+        try:
+            supabase.table("lessons").insert({
+                "id": lesson_id,
+                "child_id": child_id,
+                "uploaded_file_path": file_path,  # ensure this column exists
+                "status": "processing",
+            }).execute()
+            created = True
+        except Exception as e:
+            if getattr(e, "code", None) == "23503":  # foreign_key_violation on child_id
+                return jsonify(ok=False, error="Child not found"), 404
+            py_logger.warning("[API] lesson insert failed: %r", e)
+            return jsonify(ok=False, error="Could not create lesson"), 500
 
     # Enqueue Celery job
     try:
-        process_lesson.delay(str(lesson_id), file_path, str(child_id))
+        process_lesson.delay(lesson_id, file_path, str(child_id))
     except Exception as e:
-        if supabase:
+        if created:
             supabase.table("lessons").update({"status": "error"}).eq("id", lesson_id).execute()
+            _forget_polled_row(lesson_id)
         return jsonify(ok=False, error=f"Enqueue failed: {e}"), 500
 
     return jsonify(ok=True, lesson_id=lesson_id, status="processing"), 202
 
 # ---- API: poll lesson ----
+SPA_POLL_INTERVAL = 2.0  # seconds between GET /api/lessons/<id> polls (setTimeout in static/app.js)
+# Seconds a polled row is reused; 0 disables. Rows written by the worker process can't be evicted
+# from here, so the TTL is capped at the poll interval: a status change shows up one poll late at most.
+LESSON_POLL_TTL = min(float(os.getenv("LESSON_POLL_TTL", "2") or 0), SPA_POLL_INTERVAL)
+_POLL_CACHE_MAX = 10_000
+_poll_cache: dict = {}  # lesson_id -> (expires_at, row)
+_poll_lock = threading.Lock()
+
+def _fetch_lesson_row(lesson_id: str) -> Optional[dict]:
+    """The SPA polls every couple of seconds; serve repeat polls from memory for LESSON_POLL_TTL."""
+    now = time.monotonic()
+    with _poll_lock:
+        hit = _poll_cache.get(lesson_id)
+    if hit and hit[0] > now:
+        return hit[1]
+    res = supabase.table("lessons").select("status,lesson_data").eq("id", lesson_id).maybe_single().execute()
+    row = res.data if res is not None else None
+    if row and LESSON_POLL_TTL > 0:
+        with _poll_lock:
+            if len(_poll_cache) >= _POLL_CACHE_MAX:
+                _poll_cache.clear()
+            _poll_cache[lesson_id] = (now + LESSON_POLL_TTL, row)
+    return row
+
+def _forget_polled_row(lesson_id: str) -> None:
+    """Drop the cached poll row after this process writes the lesson, so the next poll reads it."""
+    with _poll_lock:
+        _poll_cache.pop(lesson_id, None)
+
 @bp.route("/api/lessons/<lesson_id>", methods=["GET"])
 def get_lesson(lesson_id):
     if not supabase:
         return jsonify(status="completed", lesson={"ui_steps": [{"type": "note", "text": "Dev mode lesson (no DB)."}]})
-    lesson = supabase.table("lessons").select("*").eq("id", lesson_id).maybe_single().execute()
-    if not lesson.data:
+    rec = _fetch_lesson_row(lesson_id)
+    if not rec:
         return jsonify(error="Not found"), 404
-    rec = lesson.data
-    return jsonify(status=rec.get("status"), lesson=rec.get("lesson_data"))
+    resp = jsonify(status=rec.get("status"), lesson=rec.get("lesson_data"))
+    # Unchanged polls (still "processing", or re-fetching a finished lesson) become bodyless 304s
+    resp.add_etag()
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
 
 # ---- Celery task ----
+_SNIFF_BYTES = 1024  # PDF allows junk before the %PDF- header within the first KB
+
+def _sniff_ext(head: bytes) -> Optional[str]:
+    """Extension for the file's magic bytes (PDF or a common image format); None when unrecognised."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head.startswith((b"II*\x00", b"MM\x00*")):
+        return ".tiff"
+    if b"%PDF-" in head:
+        return ".pdf"
+    return None
+
+FILE_LESSON_TTL = int(os.getenv("FILE_LESSON_TTL", str(7 * 86400)) or 0)  # reuse a finished file's lesson; 0 disables
+FILE_LOCK_TTL = 900        # seconds a worker owns an upload's digest while processing it
+FILE_LOCK_RETRY_S = 15     # a duplicate job re-queues itself this far out instead of blocking a slot
+FILE_LOCK_RETRIES = 8      # then it stops deferring and does the work itself
+
+def _file_digest(src: str | bytes) -> str:
+    """sha256 of the uploaded file, streamed from disk when given a path."""
+    if isinstance(src, bytes):
+        return hashlib.sha256(src).hexdigest()
+    h = hashlib.sha256()
+    with open(src, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
 @celery_app.task(name="tasks.process_lesson", bind=True)
 def process_lesson(self, lesson_id: str, file_path: str, child_id: str):
-    """Background job: OCR the uploaded file, derive a topic, and build a Mimi lesson."""
+    """Background job: OCR the uploaded file, derive a topic, and build a Mimi lesson (api_lessons created the row)."""
     logger.info(f"[JOB] lesson={lesson_id} child={child_id} file={file_path}")
 
     def update(fields: dict):
@@ -219,48 +784,78 @@ def process_lesson(self, lesson_id: str, file_path: str, child_id: str):
                 supabase.table("lessons").update(fields).eq("id", lesson_id).execute()
             except Exception as e:
                 logger.warning("[JOB] update failed: %r", e)
+            _forget_polled_row(lesson_id)  # matters when the job runs in the web process (eager mode)
 
+    pdf_path = None
+    lock_key = None
+    state: dict = {}  # row fields gathered during the job, flushed with the final status
     try:
         # 1) Download file (public URL)
         url = _public_storage_url(file_path)
-        r = requests.get(url, timeout=60)
-        r.raise_for_status()
-        content = r.content
-        logger.info(f"[JOB] downloaded {len(content)} bytes from {url}")
+        ext = os.path.splitext(file_path)[1].lower()
+        ext = {".jpeg": ".jpg", ".tif": ".tiff"}.get(ext, ext)
+        if ext == ".pdf":
+            # Textbooks can be tens of MB: stream to disk and let MuPDF read the file itself
+            pdf_path = _download_to_path(url, suffix=ext)
+            content = None
+            logger.info(f"[JOB] downloaded {os.path.getsize(pdf_path)} bytes from {url}")
+        else:
+            r = _storage_http.get(url, timeout=60)
+            r.raise_for_status()
+            content = r.content
+            logger.info(f"[JOB] downloaded {len(content)} bytes from {url}")
+
+        # Route on what the file is, not what it is called (phones upload JPEGs named .png, etc.)
+        if pdf_path:
+            with open(pdf_path, "rb") as f:
+                head = f.read(_SNIFF_BYTES)
+        else:
+            head = content[:_SNIFF_BYTES]
+        sniffed = _sniff_ext(head)
+        if sniffed and sniffed != ext:
+            logger.info(f"[JOB] {file_path} is actually {sniffed}; routing by content")
+            if pdf_path and sniffed != ".pdf":
+                with open(pdf_path, "rb") as f:
+                    content = f.read()
+            ext = sniffed
+
+        # Same file for the same age (e.g. a re-submit after a polling timeout): reuse the
+        # finished lesson, or wait for the worker already building it
+        age = 11  # TODO: fetch age from DB if you store it per child
+        file_key = f"file:{_file_digest(pdf_path or content)}:{age}"
+        done = cache.get_json(file_key) if FILE_LESSON_TTL > 0 else None
+        if done is None and FILE_LESSON_TTL > 0:
+            if cache.acquire_lock(file_key + ":lock", FILE_LOCK_TTL):
+                lock_key = file_key + ":lock"
+            elif self.request.retries < FILE_LOCK_RETRIES:
+                # Give the slot back; on the next run we either hit the cached lesson or, if
+                # that job failed (it caches nothing and drops the lock), take the lock ourselves
+                logger.info("[JOB] identical upload already processing; retrying in %ss", FILE_LOCK_RETRY_S)
+                raise self.retry(countdown=FILE_LOCK_RETRY_S, max_retries=FILE_LOCK_RETRIES)
+            else:
+                logger.info("[JOB] identical upload still locked after %d retries; processing anyway",
+                            FILE_LOCK_RETRIES)
+        if done:
+            logger.info(f"[JOB] lesson {lesson_id} reused the result for an identical upload")
+            update({**done, "status": "completed",
+                    "completed_at": datetime.utcnow().isoformat(timespec="seconds") + "Z"})
+            return
 
         # 2) Extract text
         text = ""
-        ext = os.path.splitext(file_path)[1].lower()
         if ext == ".pdf":
-            # Try PyMuPDF first
+            # PyMuPDF text layer, with per-page ABBYY OCR for image-only pages
             try:
-                import fitz, tempfile
-                with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
-                    f.write(content); tmp = f.name
-                doc = fitz.open(tmp)
-                for p in doc:
-                    try:
-                        t = p.get_text() or ""
-                    except Exception:
-                        t = ""
-                    text += t + "\n"
-                doc.close()
+                text = extract_text_from_pdf(pdf_path or content, language="French")
             except Exception as e:
                 logger.warning("[JOB] PDF text extraction failed: %r", e)
-
-            # If PDF text seems empty (likely image-only), use ABBYY on the whole PDF
-            if not (text or "").strip():
-                try:
-                    from app import ocr_abbyy
-                    text = ocr_abbyy.ocr_file_to_text(file_bytes=content, is_pdf=True, language="French")
-                    logger.info("[JOB] Used ABBYY OCR fallback for image-only PDF")
-                except Exception as e:
-                    logger.warning("[JOB] ABBYY OCR failed for PDF: %r", e)
         else:
             # Image file → use ABBYY (no Tesseract dependency)
             try:
                 from app import ocr_abbyy
-                text = ocr_abbyy.ocr_file_to_text(file_bytes=content, is_pdf=False, language="French")
+                text = ocr_abbyy.ocr_file_to_text(
+                    file_bytes=content, is_pdf=False, language="French", image_format=ext.lstrip(".") or "png"
+                )
             except Exception as e:
                 logger.warning("[JOB] ABBYY OCR failed for image: %r", e)
 
@@ -268,6 +863,9 @@ def process_lesson(self, lesson_id: str, file_path: str, child_id: str):
         text = text or ""
         if not text.strip():
             logger.info("[JOB] ABBYY returned empty text; attempting vision fallback")
+            if content is None:  # only a streamed PDF leaves content unset
+                with open(pdf_path, "rb") as f:
+                    content = f.read()
             text = _vision_ocr_fallback(content, ext) or ""
         if not text.strip():
             msg = "OCR extraction returned empty text"
@@ -278,7 +876,8 @@ def process_lesson(self, lesson_id: str, file_path: str, child_id: str):
         # Save and log a redacted preview of the OCR text
         preview = redact_sensitive(text[:200])
         logger.info(f"[JOB] OCR preview: {preview}")
-        update({"ocr_text": text[:20000], "ocr_preview": preview})
+        # Held back and written with the final status: one PostgREST round-trip instead of two
+        state.update({"ocr_text": text[:20000], "ocr_preview": preview})
 
         # 3) Build a full Mimi lesson from the OCR text (uses app/mimi.py)
         try:
@@ -288,8 +887,11 @@ def process_lesson(self, lesson_id: str, file_path: str, child_id: str):
                 topic=topic,                # derived from OCR text
                 ocr_text=text,              # ← your OCR output (full file)
                 image_descriptions=image_desc,
-                age=11                      # TODO: fetch age from DB if you store it per child
+                age=age
             )
+            if mimi.OPENAI_API_KEY:  # never pin the keyless demo lesson to a file
+                cache.set_json(file_key, {"ocr_text": text[:20000], "ocr_preview": preview,
+                                          "lesson_data": lesson_json}, FILE_LESSON_TTL)
         except Exception as e:
             logger.error("[JOB] mimi lesson build failed: %r", e, exc_info=True)
             # Visible fallback so the job completes
@@ -297,11 +899,22 @@ def process_lesson(self, lesson_id: str, file_path: str, child_id: str):
 
         # 4) Save & finish
         update({
+            **state,
             "lesson_data": lesson_json,
             "status": "completed",
             "completed_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
         })
         logger.info(f"[JOB] lesson {lesson_id} completed")
+    except TaskRetry:
+        raise
     except Exception as e:
         logger.error(f"[JOB] failed: {e}", exc_info=True)
-        update({"status": "error"})
+        update({**state, "status": "error"})
+    finally:
+        if lock_key:
+            cache.release_lock(lock_key)
+        if pdf_path:
+            try:
+                os.unlink(pdf_path)
+            except OSError:
+                pass
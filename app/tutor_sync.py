@@ -1,34 +1,44 @@
 # app/tutor_sync.py
 import os
 import json
+import uuid
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 
-from app import mimi  # lesson builder module
+from app import cache, mimi  # lesson builder module
+
+try:
+    import orjson  # faster, UTF-8 native; stdlib json is the fallback
+except Exception:
+    orjson = None  # type: ignore
 
 bp = Blueprint("tutor_sync", __name__)
 
 OPENAI_MODEL_IMAGE = os.getenv("OPENAI_MODEL_IMAGE", "gpt-image-1")
 OPENAI_MODEL_TEXT  = os.getenv("OPENAI_MODEL_TEXT", "gpt-4o-mini")
-OPENAI_API_KEY     = os.getenv("OPENAI_API_KEY", "")
+IMAGES_BUCKET      = os.getenv("IMAGES_BUCKET", "uploads")
+IMAGES_PREFIX      = os.getenv("IMAGES_PREFIX", "images")
+IMG_CONCURRENCY    = int(os.getenv("IMG_CONCURRENCY", "6") or 6)  # parallel image calls per request
+IMG_MAX_INFLIGHT   = int(os.getenv("IMG_MAX_INFLIGHT", "8") or 8)  # parallel image calls per process
+IMG_STORE          = os.getenv("IMG_STORE", "0") == "1"             # upload generated images, return URLs
+IMG_CACHE_TTL      = int(os.getenv("IMG_CACHE_TTL", "2592000") or 0)  # seconds a stored image is reused
+IMG_SIZE           = "1024x1024"
 
-# ----- Lazy OpenAI client (so module imports even without key/SDK) -----
-_openai_client = None
+# ----- OpenAI client: the process-wide one from mimi (one connection pool per process) -----
 def _client():
-    global _openai_client
-    if _openai_client is not None:
-        return _openai_client
-    if not OPENAI_API_KEY:
-        return None
-    try:
-        from openai import OpenAI  # require openai>=1.40 in requirements.txt
-        _openai_client = OpenAI(api_key=OPENAI_API_KEY)
-        return _openai_client
-    except Exception as e:
-        print("[BOOT] OpenAI client init failed:", repr(e))
-        return None
+    return mimi.openai_client
 
 # ----- Helpers -----
+def _dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
 def _safe_trim(text: str, limit: int = 12000) -> str:
     return (text or "")[:limit]
 
@@ -55,6 +65,148 @@ def _normalize_history(raw: Any, limit: int = 10) -> List[Dict[str, str]]:
             alt_i += 1
     return msgs[-limit:]
 
+# Process-wide cap on in-flight image calls, so concurrent requests together stay under the images RPM
+_image_slots = threading.BoundedSemaphore(IMG_MAX_INFLIGHT)
+
+def _upload_image(name: str, data: bytes, content_type: str) -> str:
+    """
+    Upload a new image into the images bucket; returns the "bucket/path" storage path.
+    Never overwrites: callers pass uuid-prefixed names, and an existing object makes Storage refuse.
+    """
+    from app import tasks  # shared Supabase client; deferred to keep this module light
+
+    path = f"{IMAGES_PREFIX}/{name}"
+    tasks.supabase.storage.from_(IMAGES_BUCKET).upload(
+        path, data, {"content-type": content_type}
+    )
+    return f"{IMAGES_BUCKET}/{path}"
+
+# Stored images by prompt: a small per-process LRU in front of the shared Redis cache
+_IMG_LRU_MAX = 512
+_img_lru: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+_img_lru_lock = threading.Lock()
+
+def _image_key(prompt: str) -> str:
+    blob = f"{OPENAI_MODEL_IMAGE}|{IMG_SIZE}|{prompt}".encode("utf-8")
+    return "img:" + hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+def _remember_image(key: str, stored: Dict[str, str]) -> None:
+    with _img_lru_lock:
+        _img_lru[key] = stored
+        _img_lru.move_to_end(key)
+        while len(_img_lru) > _IMG_LRU_MAX:
+            _img_lru.popitem(last=False)
+
+def _cached_image(key: str) -> Optional[Dict[str, str]]:
+    with _img_lru_lock:
+        hit = _img_lru.get(key)
+        if hit is not None:
+            _img_lru.move_to_end(key)
+            return hit
+    hit = cache.get_json(key)
+    if hit is not None:
+        _remember_image(key, hit)
+    return hit
+
+def _generate_image(cli, pid: str, prompt: str, store: bool = False) -> Dict[str, Any]:
+    prompt = prompt[:1800]  # gentle cap for prompt size
+    key = _image_key(prompt)
+    if store:
+        # Curriculum prompts repeat across lessons: reuse the image already in Storage
+        hit = _cached_image(key)
+        if hit is not None:
+            return {"id": pid, **hit}
+    try:
+        with _image_slots:
+            resp = cli.images.generate(
+                model=OPENAI_MODEL_IMAGE,
+                prompt=prompt,
+                size=IMG_SIZE
+            )
+        b64 = resp.data[0].b64_json
+        if store:
+            # Upload from this worker thread and hand back a URL instead of ~1.8 MB of base64
+            from app import tasks
+            safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(pid))[:60]
+            try:
+                path = _upload_image(f"{uuid.uuid4().hex}-{safe_id}.png", base64.b64decode(b64), "image/png")
+                stored = {"path": path, "url": tasks._public_storage_url(path)}
+                _remember_image(key, stored)
+                cache.set_json(key, stored, IMG_CACHE_TTL)
+                return {"id": pid, **stored}
+            except Exception as e:
+                print("[V2/generate_images] upload failed, returning base64:", repr(e))
+        data_url = f"data:image/png;base64,{b64}"
+        return {"id": pid, "b64": b64, "data_url": data_url}
+    except Exception as e:
+        # Don't fail the batch on a single error
+        return {"id": pid, "error": str(e)}
+
+def _multipart_images(images: List[Dict[str, Any]]) -> Response:
+    """One part per image: raw PNG bytes, or a small JSON body for images that failed."""
+    boundary = uuid.uuid4().hex
+    chunks: List[bytes] = []
+    for im in images:
+        name = str(im.get("id") or "").replace('"', "")
+        if im.get("b64"):
+            head = (f"Content-Type: image/png\r\n"
+                    f'Content-Disposition: form-data; name="{name}"; filename="{name}.png"\r\n')
+            body = base64.b64decode(im["b64"])
+        else:
+            head = (f"Content-Type: application/json\r\n"
+                    f'Content-Disposition: form-data; name="{name}"\r\n')
+            body = _dumps({"id": im.get("id"), "error": im.get("error")}).encode("utf-8")
+        chunks += [f"--{boundary}\r\n{head}\r\n".encode("utf-8"), body, b"\r\n"]
+    chunks.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return Response(b"".join(chunks), mimetype=f"multipart/mixed; boundary={boundary}")
+
+def _stream_lesson(topic: str, pdf_text: str, image_desc: List[str], age: int, images: bool = False, store: bool = False) -> Response:
+    """
+    NDJSON stream: one event per line, ending with a "lesson" (or "error") event.
+    With images=True, image generation starts as soon as the image_prompts section has streamed,
+    overlapping the rest of the lesson, and a final {"type": "images", "images": [...]} follows
+    the lesson (same items as /api/v2/generate_images, in the lesson's prompt order).
+    """
+    cli = _client() if images else None
+
+    def gen():
+        pool = ThreadPoolExecutor(max_workers=IMG_CONCURRENCY) if cli is not None else None
+        started: Dict[str, Any] = {}  # prompt -> future; speculative work the final lesson may not keep
+        try:
+            for event in mimi.stream_mimi_lesson(topic=topic, ocr_text=pdf_text, image_descriptions=image_desc, age=age):
+                yield _dumps(event) + "\n"
+                if pool is None:
+                    continue
+                if event["type"] == "section" and event["key"] in mimi._ALIASES["image_prompts"]:
+                    for i, it in enumerate(event["value"] if isinstance(event["value"], list) else []):
+                        prompt = (it.get("prompt") or "").strip() if isinstance(it, dict) else ""
+                        if prompt and prompt not in started:
+                            started[prompt] = pool.submit(_generate_image, cli, it.get("id") or f"img{i+1}", prompt, store)
+                elif event["type"] == "lesson":
+                    out = []
+                    for i, im in enumerate(event["lesson"].get("image_prompts") or []):
+                        prompt = (im.get("prompt") or "").strip() if isinstance(im, dict) else ""
+                        if not prompt:
+                            continue
+                        pid = im.get("id") or f"img{i+1}"
+                        if prompt not in started:  # cache hit / demo: nothing was streamed early
+                            started[prompt] = pool.submit(_generate_image, cli, pid, prompt, store)
+                        out.append((pid, started[prompt]))
+                    yield _dumps({"type": "images", "images": [{**f.result(), "id": pid} for pid, f in out]}) + "\n"
+        except Exception as e:
+            print("[V2/lesson][STREAM][ERROR]", repr(e))
+            yield _dumps({"type": "error", "error": str(e)}) + "\n"
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)  # drop speculative work the lesson didn't keep
+
+    # X-Accel-Buffering stops nginx-style proxies from holding chunks back
+    return Response(
+        stream_with_context(gen()),
+        mimetype="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
+    )
+
 # =========================
 # Routes
 # =========================
@@ -66,12 +218,21 @@ def build_lesson():
     pdf_text   = _safe_trim(body.get("pdf_text", ""))
     image_desc = body.get("image_descriptions", []) or []
     age        = int(body.get("age", 11) or 11)
+    image_desc = image_desc if isinstance(image_desc, list) else []
+
+    wants_stream = bool(body.get("stream")) or (
+        request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson"
+    )
+    if wants_stream:
+        from app import tasks
+        store = bool(body.get("store", IMG_STORE)) and tasks.supabase is not None
+        return _stream_lesson(topic, pdf_text, image_desc, age, images=bool(body.get("images")), store=store)
 
     try:
         lesson = mimi.build_mimi_lesson(
             topic=topic,
             ocr_text=pdf_text,
-            image_descriptions=image_desc if isinstance(image_desc, list) else [],
+            image_descriptions=image_desc,
             age=age
         )
         return jsonify({"ok": True, "lesson": lesson})
@@ -89,28 +250,101 @@ def generate_images():
     if cli is None:
         return jsonify({"ok": False, "error": "OPENAI_API_KEY missing or OpenAI SDK not installed"}), 503
 
-    out = []
+    jobs = []
     for p in prompts:
-        try:
-            prompt = (p.get("prompt") or "").strip()
-            if not prompt:
-                continue
-            pid = p.get("id") or f"img{len(out)+1}"
-            resp = cli.images.generate(
-                model=OPENAI_MODEL_IMAGE,
-                prompt=prompt[:1800],   # gentle cap for prompt size
-                size="1024x1024"
-            )
-            b64 = resp.data[0].b64_json
-            data_url = f"data:image/png;base64,{b64}"
-            out.append({"id": pid, "b64": b64, "data_url": data_url})
-        except Exception as e:
-            # Don't fail the batch on a single error
-            out.append({"id": p.get("id") or "", "error": str(e)})
+        prompt = (p.get("prompt") or "").strip() if isinstance(p, dict) else ""
+        if not prompt:
+            continue
+        jobs.append((p.get("id") or f"img{len(jobs)+1}", prompt))
+
+    # Clients that ask for multipart get raw PNG parts (no base64 inflation, no client-side decode)
+    multipart = request.accept_mimetypes.best_match(["application/json", "multipart/mixed"]) == "multipart/mixed"
+    # JSON clients can instead have images stored in Supabase and receive public URLs
+    from app import tasks
+    store = not multipart and bool(body.get("store", IMG_STORE)) and tasks.supabase is not None
 
+    # Each call takes seconds and is pure network wait: run them side by side.
+    # The SDK retries 429s with backoff, so no manual throttling between calls.
+    # Identical prompts within one request are generated once and shared by every id that asked
+    unique: Dict[str, str] = {}
+    for pid, prompt in jobs:
+        unique.setdefault(prompt, pid)
+    results: Dict[str, Dict[str, Any]] = {}
+    if unique:
+        workers = max(1, min(IMG_CONCURRENCY, len(unique)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            done = pool.map(lambda item: _generate_image(cli, item[1], item[0], store=store), unique.items())
+            results = dict(zip(unique, done))
+    out = [{**results[prompt], "id": pid} for pid, prompt in jobs]
+
+    if multipart:
+        return _multipart_images(out)
     return jsonify({"ok": True, "images": out})
 
 
+# Raster types only: SVG can carry script and would be served from the project's Storage domain
+_SAVE_IMAGE_TYPES = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+
+@bp.route("/api/v2/save_image_raw", methods=["POST"])
+def save_image_raw():
+    """
+    Store a generated image in Supabase Storage from the raw request body (no base64 JSON).
+    Requires a signed-in user (Authorization: Bearer <Supabase JWT>).
+    Name: ?name=<file name> or X-Filename header, stored under a fresh uuid prefix so a caller
+    can never replace an image a lesson already links to.
+    Content-Type: image/png, image/jpeg or image/webp, and the body's magic bytes must match it.
+    Legacy clients may still POST JSON {"name", "b64" | "data_url"}; it is decoded once here.
+    """
+    from app import tasks  # shared Supabase client; deferred to keep this module light
+
+    if tasks.supabase is None:
+        return jsonify({"ok": False, "error": "Supabase not configured"}), 503
+    if not tasks._get_user_id_from_auth():
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+
+    name = request.args.get("name") or request.headers.get("X-Filename") or ""
+    content_type = request.mimetype or "image/png"
+    if content_type == "application/json":
+        body = request.get_json(silent=True)
+        body = body if isinstance(body, dict) else {}
+        name = name or body.get("name") or ""
+        b64 = body.get("b64") or body.get("data_url") or ""
+        if not isinstance(name, str) or not isinstance(b64, str):
+            return jsonify({"ok": False, "error": "name and b64/data_url must be strings"}), 400
+        head, sep, tail = b64.partition(";base64,")
+        content_type = head[len("data:"):] if sep and head.startswith("data:") else "image/png"
+        try:
+            data = base64.b64decode(tail if sep else b64, validate=True)
+        except Exception:
+            return jsonify({"ok": False, "error": "invalid base64"}), 400
+    else:
+        data = request.get_data(cache=False)
+
+    name = os.path.basename(name).strip()
+    if not name:
+        return jsonify({"ok": False, "error": "name is required"}), 400
+    if content_type not in _SAVE_IMAGE_TYPES:
+        return jsonify({"ok": False, "error": "Content-Type must be image/png, image/jpeg or image/webp"}), 415
+    if not data:
+        return jsonify({"ok": False, "error": "empty body"}), 400
+    if tasks._sniff_ext(data[:tasks._SNIFF_BYTES]) != _SAVE_IMAGE_TYPES[content_type]:
+        return jsonify({"ok": False, "error": "body does not match Content-Type"}), 415
+
+    try:
+        full_path = _upload_image(f"{uuid.uuid4().hex}-{name}", data, content_type)
+    except Exception as e:
+        print("[V2/save_image_raw][ERROR]", repr(e))
+        return jsonify({"ok": False, "error": str(e)}), 500
+    return jsonify({"ok": True, "path": full_path, "url": tasks._public_storage_url(full_path)})
+
+
+_CHAT_PREAMBLE = (
+    "You are Mimi, a friendly French tutor. Teach gently, one step at a time. "
+    "Encourage speaking. Use simple FR with tiny EN glosses when needed. "
+    'Give hints instead of full answers. Keep replies under 120 words.\n\n'
+    "Lesson JSON (context):\n"
+)
+
 @bp.route("/api/v2/chat", methods=["POST"])
 def tutor_chat():
     body: Dict[str, Any] = request.get_json(force=True, silent=True) or {}
@@ -127,13 +361,7 @@ def tutor_chat():
         return jsonify({"ok": True, "reply": "Mode démo : dis-moi de quoi tu veux parler aujourd’hui 😊"})
 
     # Put a trimmed lesson JSON into the system prompt as context
-    lesson_ctx = json.dumps(lesson, ensure_ascii=False)[:8000]
-    system = (
-        "You are Mimi, a friendly French tutor. Teach gently, one step at a time. "
-        "Encourage speaking. Use simple FR with tiny EN glosses when needed. "
-        'Give hints instead of full answers. Keep replies under 120 words.\n\n'
-        f"Lesson JSON (context):\n{lesson_ctx}"
-    )
+    system = _CHAT_PREAMBLE + _dumps(lesson)[:8000]
 
     messages = [{"role": "system", "content": system}] + history + [{"role": "user", "content": message}]
     try:
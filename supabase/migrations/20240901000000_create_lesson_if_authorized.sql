@@ -0,0 +1,33 @@
+-- Check child ownership and create the lesson row in a single round-trip.
+-- Raises P0002 when the child does not exist and 42501 when it belongs to another parent.
+CREATE OR REPLACE FUNCTION public.create_lesson_if_authorized(
+  p_id uuid,
+  p_child uuid,
+  p_path text,
+  p_user uuid
+) RETURNS uuid
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_parent uuid;
+BEGIN
+  SELECT parent_id INTO v_parent FROM children WHERE id = p_child;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Child not found' USING ERRCODE = 'P0002';
+  END IF;
+  IF v_parent <> p_user THEN
+    RAISE EXCEPTION 'Not authorized for this child' USING ERRCODE = '42501';
+  END IF;
+
+  INSERT INTO lessons (id, child_id, uploaded_file_path, status)
+  VALUES (p_id, p_child, p_path, 'processing')
+  ON CONFLICT (id) DO NOTHING;
+
+  RETURN p_id;
+END;
+$$;
+
+-- Only the backend (service role) calls this
+REVOKE ALL ON FUNCTION public.create_lesson_if_authorized(uuid, uuid, text, uuid) FROM PUBLIC, anon, authenticated;
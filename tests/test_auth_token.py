@@ -0,0 +1,46 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app.tasks as tasks
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _token(payload, secret="s3cret"):
+    head = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    body = _b64(json.dumps(payload).encode())
+    sig = hmac.new(secret.encode(), f"{head}.{body}".encode(), hashlib.sha256).digest()
+    return f"{head}.{body}.{_b64(sig)}"
+
+
+def _user_id(token):
+    app = Flask(__name__)
+    with app.test_request_context(headers={"Authorization": f"Bearer {token}"}):
+        return tasks._get_user_id_from_auth()
+
+
+def test_signature_is_verified_when_secret_set(monkeypatch):
+    monkeypatch.setattr(tasks, "SUPABASE_JWT_SECRET", "s3cret")
+    monkeypatch.setattr(tasks, "_auth_cache", {})
+    exp = time.time() + 3600
+    assert _user_id(_token({"sub": "user-1", "exp": exp})) == "user-1"
+    assert _user_id(_token({"sub": "user-2", "exp": exp}, secret="wrong")) is None
+    assert _user_id(_token({"sub": "user-3", "exp": time.time() - 10})) is None
+
+
+def test_unverified_payload_without_secret(monkeypatch):
+    monkeypatch.setattr(tasks, "SUPABASE_JWT_SECRET", "")
+    monkeypatch.setattr(tasks, "_auth_cache", {})
+    assert _user_id(_token({"sub": "user-1"}, secret="anything")) == "user-1"
+    assert _user_id("not-a-jwt") is None
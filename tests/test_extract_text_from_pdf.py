@@ -0,0 +1,181 @@
+import os
+import sys
+
+import fitz
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app import ocr_abbyy
+from app.tasks import extract_text_from_pdf_bytes
+
+
+def _make_pdf(page_texts):
+    doc = fitz.open()
+    for t in page_texts:
+        page = doc.new_page()
+        if t:
+            page.insert_text((72, 72), t)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_ocr_only_image_pages_and_keep_order(monkeypatch):
+    calls = []
+
+    def fake_ocr(file_bytes, is_pdf, language="French", image_format="png", exit_on_low_conf=True):
+        assert exit_on_low_conf is False
+        calls.append(is_pdf)
+        return "texte OCR"
+
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", fake_ocr)
+    long_text = "Le chat regarde la ville depuis la fenêtre de la cuisine."
+    pdf = _make_pdf([long_text, "", long_text])
+
+    text = extract_text_from_pdf_bytes(pdf)
+    parts = text.split("\n\n")
+    assert len(parts) == 3
+    assert "chat" in parts[0]
+    assert parts[1].strip() == "texte OCR"
+    assert "chat" in parts[2]
+    assert calls == [False]
+
+
+def test_mostly_scanned_pdf_is_sent_to_abbyy_once(monkeypatch):
+    calls = []
+
+    def fake_ocr(file_bytes, is_pdf, language="French", image_format="png", exit_on_low_conf=True):
+        assert exit_on_low_conf is False
+        calls.append(is_pdf)
+        return "document OCR"
+
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", fake_ocr)
+    pdf = _make_pdf(["", "", "Le chat regarde la ville depuis la fenêtre de la cuisine."])
+
+    assert extract_text_from_pdf_bytes(pdf) == "document OCR"
+    assert calls == [True]
+
+
+def test_merged_tiff_upload_is_split_back_per_page(monkeypatch):
+    import app.tasks as tasks
+
+    calls = []
+
+    def fake_ocr(file_bytes, is_pdf, language="French", image_format="png", exit_on_low_conf=True):
+        assert exit_on_low_conf is False
+        calls.append(image_format)
+        return "page un\fpage deux"
+
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", fake_ocr)
+    monkeypatch.setattr(tasks, "OCR_MERGE_TIFF", True)
+    long_text = "Le chat regarde la ville depuis la fenêtre de la cuisine."
+    pdf = _make_pdf([long_text, "", long_text, "", long_text])
+
+    parts = extract_text_from_pdf_bytes(pdf).split("\n\n")
+    assert calls == ["tiff"]
+    assert parts[1].strip() == "page un"
+    assert parts[3].strip() == "page deux"
+
+
+def test_extract_text_from_pdf_path(monkeypatch, tmp_path):
+    from app.tasks import extract_text_from_pdf
+
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", lambda *a, **k: "")
+    path = tmp_path / "lesson.pdf"
+    path.write_bytes(_make_pdf(["Le chat regarde la ville depuis la fenêtre de la cuisine."]))
+
+    assert "chat" in extract_text_from_pdf(str(path))
+
+
+def test_dense_text_pdf_skips_ocr(monkeypatch):
+    import app.tasks as tasks
+
+    def fail_ocr(*args, **kwargs):
+        raise AssertionError("OCR should not run for born-digital PDFs")
+
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", fail_ocr)
+    monkeypatch.setattr(tasks, "PDF_DENSE_PAGE_CHARS", 20)
+    long_text = "Le chat regarde la ville depuis la fenêtre de la cuisine."
+    pdf = _make_pdf([long_text, long_text, long_text])
+
+    assert extract_text_from_pdf_bytes(pdf).count("chat") == 3
+
+
+def test_scanned_pdf_stops_classifying_once_batch_is_decided(monkeypatch):
+    import app.tasks as tasks
+
+    seen = []
+    classify = tasks._classify_pages
+    monkeypatch.setattr(tasks, "_classify_pages", lambda doc, **kw: seen.append(kw) or classify(doc, **kw))
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", lambda *a, **k: "")
+    long_text = "Le chat regarde la ville depuis la fenêtre de la cuisine."
+    pdf = _make_pdf(["", "", long_text, long_text])
+
+    # ABBYY returns nothing, so the skipped pages' text layer is read after all
+    assert extract_text_from_pdf_bytes(pdf).count("chat") == 2
+    assert seen == [{"batch_at": 2}, {"start": 2}]
+
+
+def test_large_pdf_path_is_read_across_processes(monkeypatch, tmp_path):
+    import app.tasks as tasks
+
+    monkeypatch.setattr(tasks, "PDF_PROCESS_WORKERS", 2)
+    monkeypatch.setattr(tasks, "PDF_PARALLEL_MIN_PAGES", 2)
+    monkeypatch.setattr(tasks, "PDF_PARALLEL_CHUNK", 2)
+    monkeypatch.setattr(tasks, "PDF_DENSE_PAGE_CHARS", 20)
+    path = tmp_path / "book.pdf"
+    path.write_bytes(_make_pdf([f"Page {n} : le chat regarde la ville." for n in range(5)]))
+
+    texts = tasks._parallel_page_texts(str(path), 5)
+    assert [t.split(":")[0].strip() for t in texts] == [f"Page {n}" for n in range(5)]
+    assert tasks.extract_text_from_pdf(str(path)).count("chat") == 5
+
+
+def test_vision_fallback_sends_pdf_pages_as_images_concurrently(monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+
+    import app.tasks as tasks
+    from app import mimi
+
+    urls = []
+
+    class Responses:
+        async def create(self, model, input):
+            url = input[0]["content"][1]["image_url"]
+            urls.append(url)
+            await asyncio.sleep(0.01)  # both calls are in flight before either returns
+            return SimpleNamespace(output_text=f"{len(urls)} in flight")
+
+    monkeypatch.setattr(mimi, "_async_openai_client", lambda: SimpleNamespace(responses=Responses()))
+    images = tasks._vision_images(_make_pdf(["", ""]), ".pdf")
+
+    texts = asyncio.run(tasks._vision_describe_many(images))
+    assert texts == ["2 in flight", "2 in flight"]
+    assert all(u.startswith("data:image/jpeg;base64,") for u in urls)
+    assert tasks._vision_images(b"\x89PNG", ".png") == [("image/png", b"\x89PNG")]
+
+
+def test_vision_run_closes_its_loop_client(monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+
+    import app.tasks as tasks
+    from app import mimi
+
+    closed = []
+
+    class Client:
+        responses = SimpleNamespace(create=None)
+
+        async def close(self):
+            closed.append(1)
+
+    async def fake_many(images):
+        mimi._async_clients[asyncio.get_running_loop()] = Client()
+        return ["texte"]
+
+    monkeypatch.setattr(tasks, "_vision_describe_many", fake_many)
+    assert asyncio.run(tasks._vision_describe_all([("image/png", b"x")])) == ["texte"]
+    assert closed == [1]
+    assert len(mimi._async_clients) == 0
@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app import tutor_sync
+
+
+class FakeImages:
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, model, prompt, size):
+        self.prompts.append(prompt)
+        time.sleep(0.01)
+        if prompt == "boom":
+            raise RuntimeError("rate limited")
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=f"b64:{prompt}")])
+
+
+def create_client(monkeypatch):
+    fake = SimpleNamespace(images=FakeImages())
+    monkeypatch.setattr(tutor_sync, "_client", lambda: fake)
+    app = Flask(__name__)
+    app.register_blueprint(tutor_sync.bp)
+    return app.test_client(), fake
+
+
+def test_generate_images_keeps_prompt_order(monkeypatch):
+    client, fake = create_client(monkeypatch)
+    prompts = [
+        {"id": "cover_scene", "prompt": "tour Eiffel"},
+        {"prompt": "  "},
+        {"prompt": "croissant"},
+        {"id": "bad", "prompt": "boom"},
+    ]
+    res = client.post("/api/v2/generate_images", json={"image_prompts": prompts})
+    data = res.get_json()
+    assert res.status_code == 200
+    assert [im["id"] for im in data["images"]] == ["cover_scene", "img2", "bad"]
+    assert data["images"][0]["b64"] == "b64:tour Eiffel"
+    assert data["images"][2]["error"] == "rate limited"
+    assert sorted(fake.images.prompts) == ["boom", "croissant", "tour Eiffel"]
+
+
+def test_generate_images_multipart(monkeypatch):
+    import base64
+    from email import message_from_bytes
+
+    class PngImages(FakeImages):
+        def generate(self, model, prompt, size):
+            raw = b"\x89PNG-" + prompt.encode()
+            return SimpleNamespace(data=[SimpleNamespace(b64_json=base64.b64encode(raw).decode())])
+
+    client, fake = create_client(monkeypatch)
+    fake.images = PngImages()
+    res = client.post(
+        "/api/v2/generate_images",
+        json={"image_prompts": [{"id": "cover_scene", "prompt": "tour"}]},
+        headers={"Accept": "multipart/mixed"},
+    )
+    assert res.mimetype == "multipart/mixed"
+    msg = message_from_bytes(b"Content-Type: " + res.headers["Content-Type"].encode() + b"\r\n\r\n" + res.data)
+    parts = msg.get_payload()
+    assert len(parts) == 1
+    assert parts[0].get_param("filename", header="content-disposition") == "cover_scene.png"
+    assert parts[0].get_payload(decode=True) == b"\x89PNG-tour"
+
+
+PNG = b"\x89PNG\r\n\x1a\ndata"
+JPEG = b"\xff\xd8\xff\xe0jpeg"
+
+
+def test_save_image_raw_uploads_body(monkeypatch):
+    import app.tasks as tasks
+
+    uploads = []
+
+    class Bucket:
+        def upload(self, path, data, options):
+            uploads.append((path, data, options["content-type"]))
+
+    storage = SimpleNamespace(from_=lambda bucket: Bucket())
+    monkeypatch.setattr(tasks, "supabase", SimpleNamespace(storage=storage))
+    monkeypatch.setattr(tasks, "_get_user_id_from_auth", lambda: "parent")
+    client, _ = create_client(monkeypatch)
+
+    res = client.post(
+        "/api/v2/save_image_raw?name=../cover.png",
+        data=PNG,
+        headers={"Content-Type": "image/png"},
+    )
+    assert res.status_code == 200
+    path = res.get_json()["path"]
+    assert path.startswith("uploads/images/") and path.endswith("-cover.png")
+    assert uploads == [(path[len("uploads/"):], PNG, "image/png")]
+
+    # A second upload under the same name never targets the first object
+    client.post("/api/v2/save_image_raw?name=cover.png", data=PNG, headers={"Content-Type": "image/png"})
+    assert uploads[1][0] != uploads[0][0]
+
+
+def test_save_image_raw_rejects_anonymous_svg_and_mismatched_bodies(monkeypatch):
+    import app.tasks as tasks
+
+    uploads = []
+
+    class Bucket:
+        def upload(self, path, data, options):
+            uploads.append(path)
+
+    monkeypatch.setattr(tasks, "supabase", SimpleNamespace(storage=SimpleNamespace(from_=lambda bucket: Bucket())))
+    client, _ = create_client(monkeypatch)
+    url = "/api/v2/save_image_raw?name=x.png"
+
+    monkeypatch.setattr(tasks, "_get_user_id_from_auth", lambda: None)
+    assert client.post(url, data=PNG, headers={"Content-Type": "image/png"}).status_code == 401
+
+    monkeypatch.setattr(tasks, "_get_user_id_from_auth", lambda: "parent")
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+    assert client.post(url, data=svg, headers={"Content-Type": "image/svg+xml"}).status_code == 415
+    assert client.post(url, data=b"<html>", headers={"Content-Type": "image/png"}).status_code == 415
+    assert client.post(url, data=JPEG, headers={"Content-Type": "image/png"}).status_code == 415
+    assert client.post("/api/v2/save_image_raw", json={"name": 3, "b64": "AAAA"}).status_code == 400
+    assert client.post("/api/v2/save_image_raw", json={"name": "a.png", "b64": ["x"]}).status_code == 400
+    assert uploads == []
+
+
+def test_generate_images_store_returns_urls(monkeypatch):
+    import base64
+    import app.tasks as tasks
+
+    uploads = []
+
+    class Bucket:
+        def upload(self, path, data, options):
+            uploads.append((path, data))
+
+    storage = SimpleNamespace(from_=lambda bucket: Bucket())
+    monkeypatch.setattr(tasks, "supabase", SimpleNamespace(storage=storage))
+    client, fake = create_client(monkeypatch)
+
+    b64 = base64.b64encode(b"\x89PNG").decode()
+    fake.images.generate = lambda model, prompt, size: SimpleNamespace(data=[SimpleNamespace(b64_json=b64)])
+    res = client.post("/api/v2/generate_images", json={"image_prompts": [{"id": "cover", "prompt": "tour"}], "store": True})
+    image = res.get_json()["images"][0]
+    assert "b64" not in image
+    assert image["path"].startswith("uploads/images/") and image["path"].endswith("-cover.png")
+    assert image["url"].endswith(image["path"])
+    assert uploads == [(image["path"][len("uploads/"):], b"\x89PNG")]
+
+
+def test_generate_images_dedups_and_reuses_stored(monkeypatch):
+    import app.tasks as tasks
+
+    class Bucket:
+        def upload(self, path, data, options):
+            pass
+
+    monkeypatch.setattr(tasks, "supabase", SimpleNamespace(storage=SimpleNamespace(from_=lambda bucket: Bucket())))
+    monkeypatch.setattr(tutor_sync.cache, "get_json", lambda key: None)
+    monkeypatch.setattr(tutor_sync.cache, "set_json", lambda key, value, ttl: None)
+    monkeypatch.setattr(tutor_sync, "_img_lru", tutor_sync.OrderedDict())
+    client, fake = create_client(monkeypatch)
+    fake.images.generate = lambda model, prompt, size: (
+        fake.images.prompts.append(prompt) or SimpleNamespace(data=[SimpleNamespace(b64_json="iVBORw==")])
+    )
+
+    prompts = [{"id": "a", "prompt": "chat"}, {"id": "b", "prompt": "chat"}]
+    first = client.post("/api/v2/generate_images", json={"image_prompts": prompts, "store": True}).get_json()
+    second = client.post("/api/v2/generate_images", json={"image_prompts": prompts[:1], "store": True}).get_json()
+
+    assert fake.images.prompts == ["chat"]
+    assert [im["id"] for im in first["images"]] == ["a", "b"]
+    assert first["images"][0]["url"] == first["images"][1]["url"] == second["images"][0]["url"]
+
+
+def test_save_image_raw_header_name_and_legacy_json(monkeypatch):
+    import base64
+    import app.tasks as tasks
+
+    uploads = []
+
+    class Bucket:
+        def upload(self, path, data, options):
+            assert "x-upsert" not in options
+            uploads.append((path.split("-", 1)[1], data, options["content-type"]))
+
+    monkeypatch.setattr(tasks, "supabase", SimpleNamespace(storage=SimpleNamespace(from_=lambda bucket: Bucket())))
+    monkeypatch.setattr(tasks, "_get_user_id_from_auth", lambda: "parent")
+    client, _ = create_client(monkeypatch)
+
+    res = client.post(
+        "/api/v2/save_image_raw",
+        data=JPEG,
+        headers={"Content-Type": "image/jpeg", "X-Filename": "card.jpg"},
+    )
+    assert res.status_code == 200
+    data_url = "data:image/png;base64," + base64.b64encode(PNG).decode()
+    res = client.post("/api/v2/save_image_raw", json={"name": "old.png", "data_url": data_url})
+    assert res.status_code == 200
+    assert uploads == [
+        ("card.jpg", JPEG, "image/jpeg"),
+        ("old.png", PNG, "image/png"),
+    ]
+
+
+def test_stream_lesson_starts_images_from_streamed_prompts(monkeypatch):
+    import json
+
+    client, fake = create_client(monkeypatch)
+    prompts = [{"id": "cover", "prompt": "tour"}, {"id": "old", "prompt": "dropped"}]
+
+    def fake_stream(**kwargs):
+        yield {"type": "section", "key": "image_prompts", "value": prompts}
+        final = [{"id": "cover", "prompt": "tour"}, {"id": "blank", "prompt": "  "}, {"id": "none"}, {"id": "img2", "prompt": "chat"}]
+        yield {"type": "lesson", "lesson": {"image_prompts": final}}
+
+    monkeypatch.setattr(tutor_sync.mimi, "stream_mimi_lesson", fake_stream)
+    res = client.post("/api/v2/lesson", json={"topic": "x", "stream": True, "images": True})
+    events = [json.loads(line) for line in res.data.decode().splitlines()]
+
+    assert [e["type"] for e in events] == ["section", "lesson", "images"]
+    assert [(im["id"], im["b64"]) for im in events[-1]["images"]] == [("cover", "b64:tour"), ("img2", "b64:chat")]
+    assert fake.images.prompts.count("tour") == 1
@@ -0,0 +1,57 @@
+import os
+import sys
+from types import SimpleNamespace
+
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app.tasks as tasks
+
+
+class FakeQuery:
+    def __init__(self, db):
+        self.db = db
+
+    def select(self, *args):
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def maybe_single(self):
+        return self
+
+    def execute(self):
+        self.db.reads += 1
+        return SimpleNamespace(data={"status": "processing", "lesson_data": None})
+
+
+class FakeDB:
+    def __init__(self):
+        self.reads = 0
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+def test_polls_are_cached_and_conditional(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(tasks, "supabase", db)
+    monkeypatch.setattr(tasks, "_poll_cache", {})
+    app = Flask(__name__)
+    app.register_blueprint(tasks.bp)
+    client = app.test_client()
+
+    first = client.get("/api/lessons/abc")
+    assert first.status_code == 200
+    assert first.get_json()["status"] == "processing"
+
+    second = client.get("/api/lessons/abc", headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 304
+    assert db.reads == 1
+
+    tasks._forget_polled_row("abc")  # this process wrote the row
+    client.get("/api/lessons/abc")
+    assert db.reads == 2
+    assert tasks.LESSON_POLL_TTL <= tasks.SPA_POLL_INTERVAL
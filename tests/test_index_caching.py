@@ -0,0 +1,31 @@
+import gzip
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.main import app
+
+
+def test_index_is_cacheable_and_conditional():
+    client = app.test_client()
+    first = client.get("/")
+    assert first.status_code == 200
+    assert b"<html" in first.data.lower()
+    assert "max-age=60" in first.headers["Cache-Control"]
+
+    again = client.get("/", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+
+
+def test_index_gzip_variant():
+    res = app.test_client().get("/", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert b"<html" in gzip.decompress(res.data).lower()
+
+
+def test_json_loads_accepts_what_stdlib_accepts():
+    assert app.json.loads('{"score": NaN, "big": 123456789012345678901234567890}')["big"] == 123456789012345678901234567890
+    assert app.json.loads(b'{"title": "\\u00e9t\\u00e9"}') == {"title": "été"}
+    assert app.json.dumps({"b": 1, "a": "été"}) == '{"a":"été","b":1}'
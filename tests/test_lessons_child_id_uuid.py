@@ -1,4 +1,6 @@
 import uuid
+from types import SimpleNamespace
+
 from flask import Flask
 
 import app.tasks as tasks
@@ -36,3 +38,155 @@ def test_api_lessons_accepts_uuid(monkeypatch):
     data = res.get_json()
     assert data["ok"] is True
     assert data["lesson_id"]
+
+
+def test_api_lessons_anonymous_creates_row_and_rejects_unknown_child(monkeypatch):
+    app = create_app()
+    client = app.test_client()
+
+    class MissingChild(Exception):
+        code = "23503"
+
+    inserts = []
+
+    class DB:
+        def table(self, name):
+            db = self
+
+            class Insert:
+                def __init__(self, row):
+                    self.row = row
+
+                def execute(self):
+                    inserts.append(self.row)
+                    if self.row["child_id"] == db.missing:
+                        raise MissingChild("violates foreign key constraint")
+
+            return SimpleNamespace(insert=Insert)
+
+    db = DB()
+    db.missing = str(uuid.uuid4())
+    monkeypatch.setattr(tasks, "supabase", db)
+    calls = []
+    monkeypatch.setattr(tasks.process_lesson, "delay", lambda *args, **kwargs: calls.append((args, kwargs)))
+
+    child_id = str(uuid.uuid4())
+    res = client.post("/api/lessons", json={"child_id": child_id, "file_path": "f.pdf"})
+    assert res.status_code == 202
+    lesson_id = res.get_json()["lesson_id"]
+    assert inserts[0] == {"id": lesson_id, "child_id": child_id, "uploaded_file_path": "f.pdf", "status": "processing"}
+    assert calls == [((lesson_id, "f.pdf", child_id), {})]
+
+    res = client.post("/api/lessons", json={"child_id": db.missing, "file_path": "f.pdf"})
+    assert res.status_code == 404
+    assert len(calls) == 1
+
+
+def test_api_lessons_authorizes_and_creates_in_one_rpc(monkeypatch):
+    app = create_app()
+    client = app.test_client()
+
+    class Forbidden(Exception):
+        code = "42501"
+
+    class BadUuid(Exception):
+        code = "22P02"
+
+    rpcs = []
+
+    class DB:
+        def rpc(self, fn, params):
+            rpcs.append((fn, params))
+            outcome = params["p_user"]
+
+            class Call:
+                def execute(self):
+                    if outcome == "intruder":
+                        raise Forbidden("Not authorized for this child")
+                    if outcome == "service-role":
+                        raise BadUuid("invalid input syntax for type uuid")
+
+            return Call()
+
+    monkeypatch.setattr(tasks, "supabase", DB())
+    monkeypatch.setattr(tasks.process_lesson, "delay", lambda *args, **kwargs: None)
+    child_id = str(uuid.uuid4())
+
+    monkeypatch.setattr(tasks, "_get_user_id_from_auth", lambda: "parent")
+    res = client.post("/api/lessons", json={"child_id": child_id, "file_path": "f.pdf"})
+    assert res.status_code == 202
+    assert rpcs[0] == ("create_lesson_if_authorized", {
+        "p_id": res.get_json()["lesson_id"], "p_child": child_id, "p_path": "f.pdf", "p_user": "parent",
+    })
+
+    monkeypatch.setattr(tasks, "_get_user_id_from_auth", lambda: "intruder")
+    res = client.post("/api/lessons", json={"child_id": child_id, "file_path": "f.pdf"})
+    assert res.status_code == 403
+
+    monkeypatch.setattr(tasks, "_get_user_id_from_auth", lambda: "service-role")
+    res = client.post("/api/lessons", json={"child_id": child_id, "file_path": "f.pdf"})
+    assert res.status_code == 403
+
+    # A token that fails verification is a 401, not a silent downgrade to anonymous
+    monkeypatch.setattr(tasks, "_get_user_id_from_auth", lambda: None)
+    res = client.post("/api/lessons", json={"child_id": child_id, "file_path": "f.pdf"},
+                      headers={"Authorization": "Bearer expired"})
+    assert res.status_code == 401
+    assert len(rpcs) == 3
+
+
+def test_api_lessons_sheds_load_when_queue_is_deep(monkeypatch):
+    app = create_app()
+    client = app.test_client()
+    calls = []
+    monkeypatch.setattr(tasks.process_lesson, "delay", lambda *args, **kwargs: calls.append(args))
+    monkeypatch.setattr(tasks, "MAX_QUEUED_LESSONS", 10)
+    monkeypatch.setattr(tasks, "_lesson_queue_depth", lambda: 10)
+
+    res = client.post("/api/lessons", json={"child_id": str(uuid.uuid4()), "file_path": "f.pdf"})
+    assert res.status_code == 429
+    assert res.headers["Retry-After"] == "5"
+    assert res.get_json()["error"] == "busy"
+    assert calls == []
+
+
+def test_queue_depth_refresh_runs_outside_the_lock_once(monkeypatch):
+    import threading
+
+    started, release = threading.Event(), threading.Event()
+    connects = []
+
+    class Conn:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def ensure_connection(self, max_retries, timeout):
+            assert max_retries == 0 and timeout <= 1
+            started.set()
+            release.wait(5)
+
+        @property
+        def default_channel(self):
+            return SimpleNamespace(queue_declare=lambda queue, passive: SimpleNamespace(message_count=7))
+
+    fake_app = SimpleNamespace(
+        conf=SimpleNamespace(task_default_queue="celery"),
+        connection_for_write=lambda connect_timeout: connects.append(connect_timeout) or Conn(),
+    )
+    monkeypatch.setattr(tasks, "celery_app", fake_app)
+    monkeypatch.setattr(tasks, "_queue_depth", (0.0, 3))
+
+    results = []
+    refresher = threading.Thread(target=lambda: results.append(tasks._lesson_queue_depth()))
+    refresher.start()
+    assert started.wait(5)
+    assert tasks._lesson_queue_depth() == 3  # stale value while the broker call is in flight
+    release.set()
+    refresher.join(5)
+
+    assert results == [7] and len(connects) == 1
+    assert tasks._lesson_queue_depth() == 7  # fresh now, no second broker call
+    assert len(connects) == 1
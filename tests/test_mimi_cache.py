@@ -0,0 +1,268 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app import cache, mimi
+
+LESSON = {
+    "title": "Les couleurs",
+    "duration": "30 min",
+    "objectives": ["Nommer les couleurs", "Dire 'C'est rouge'"],
+    "materials": ["Crayons"],
+    "warm_up": {"name": "Échauffement", "minutes": "5", "teacher_script": "Regarde !"},
+    "quiz": [{"question": "Rouge ?", "options": ["red", "blue"], "correct_option": "red"}],
+}
+
+
+@pytest.fixture(autouse=True)
+def empty_lru(monkeypatch):
+    monkeypatch.setattr(mimi, "_lesson_lru", mimi.OrderedDict())
+
+
+def fake_client(**attrs):
+    client = SimpleNamespace(**attrs)
+    client.with_options = lambda **kwargs: client
+    return client
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=json.dumps(LESSON))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def test_identical_payload_hits_cache(monkeypatch):
+    store = {}
+    monkeypatch.setattr(cache, "get_json", lambda key: store.get(key))
+    monkeypatch.setattr(cache, "set_json", lambda key, value, ttl: store.__setitem__(key, value))
+    completions = FakeCompletions()
+    monkeypatch.setattr(mimi, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(mimi, "openai_client", fake_client(chat=SimpleNamespace(completions=completions)))
+
+    payload = {"topic_hint": "couleurs", "pdf_text_excerpt": "rouge bleu", "image_descriptions": [], "age": 9}
+    first = mimi._chat_json_strict(payload)
+    second = mimi._chat_json_strict(dict(payload))
+    third = mimi._chat_json_strict({**payload, "topic_hint": "  Couleurs "})
+
+    assert completions.calls == 1
+    assert first == second == third
+    assert first["title"] == "Les couleurs"
+
+
+def test_stream_yields_deltas_then_lesson(monkeypatch):
+    monkeypatch.setattr(cache, "get_json", lambda key: None)
+    monkeypatch.setattr(cache, "set_json", lambda key, value, ttl: None)
+    text = json.dumps(LESSON)
+    pieces = [text[:10], text[10:]]
+
+    class StreamingCompletions:
+        def create(self, **kwargs):
+            assert kwargs["stream"] is True
+            return iter(
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p))]) for p in pieces
+            )
+
+    monkeypatch.setattr(mimi, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(mimi, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=StreamingCompletions())))
+
+    events = list(mimi.stream_mimi_lesson(topic="couleurs"))
+    assert [e["text"] for e in events if e["type"] == "delta"] == pieces
+    sections = [e["key"] for e in events if e["type"] == "section"]
+    assert sections == list(LESSON)
+    assert next(e for e in events if e.get("key") == "warm_up")["value"] == LESSON["warm_up"]
+    assert events[0]["type"] == "stream_start" and events[-2]["type"] == "stream_end"
+    blocks = [e for e in events if e["type"].startswith(("content_block", "text_delta"))]
+    assert blocks == [
+        {"type": "content_block_start", "index": 0, "name": "Échauffement"},
+        {"type": "text_delta", "index": 0, "delta": "Regarde !"},
+        {"type": "content_block_end", "index": 0},
+    ]
+    assert events[-1]["type"] == "lesson"
+    assert events[-1]["lesson"]["title"] == "Les couleurs"
+    assert events[-1]["lesson"]["ui_steps"]
+
+
+def test_async_build_uses_async_client(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(cache, "get_json", lambda key: None)
+    monkeypatch.setattr(cache, "set_json", lambda key, value, ttl: None)
+    calls = []
+
+    class AsyncCompletions:
+        async def create(self, **kwargs):
+            calls.append(kwargs["model"])
+            message = SimpleNamespace(content=json.dumps(LESSON))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=AsyncCompletions()))
+    monkeypatch.setattr(mimi, "_async_openai_client", lambda: fake)
+
+    lesson = asyncio.run(mimi.build_mimi_lesson_async(topic="couleurs"))
+    assert len(calls) == 1
+    assert lesson["title"] == "Les couleurs"
+    assert lesson["ui_steps"]
+
+
+def test_batch_api_maps_results_back_in_order(monkeypatch):
+    monkeypatch.setattr(cache, "get_json", lambda key: None)
+    monkeypatch.setattr(cache, "set_json", lambda key, value, ttl: None)
+    monkeypatch.setattr(mimi, "BATCH_POLL_SECONDS", 0)
+    uploaded = {}
+
+    class Files:
+        def create(self, file, purpose):
+            uploaded["lines"] = [json.loads(l) for l in file[1].decode().splitlines()]
+            return SimpleNamespace(id="file-in")
+
+        def content(self, file_id):
+            rows = []
+            for req in reversed(uploaded["lines"]):  # output order is not guaranteed
+                body = {"choices": [{"message": {"content": json.dumps(LESSON)}}]}
+                if req["custom_id"] == "1":
+                    body = {"error": "boom"}
+                rows.append(json.dumps({"custom_id": req["custom_id"], "response": {"body": body}}))
+            return SimpleNamespace(text="\n".join(rows))
+
+    class Batches:
+        def __init__(self):
+            self.polls = 0
+
+        def create(self, **kwargs):
+            assert kwargs["endpoint"] == "/v1/chat/completions"
+            return SimpleNamespace(id="batch-1", status="in_progress", output_file_id=None)
+
+        def retrieve(self, batch_id):
+            self.polls += 1
+            return SimpleNamespace(id=batch_id, status="completed", output_file_id="file-out")
+
+    monkeypatch.setattr(mimi, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(mimi, "openai_client", SimpleNamespace(files=Files(), batches=Batches()))
+
+    lessons = mimi.build_mimi_lesson_batch([{"topic": "a"}, {"topic": "b"}, {"topic": "c"}])
+    assert [l and l["title"] for l in lessons] == ["Les couleurs", None, "Les couleurs"]
+    assert lessons[0]["ui_steps"]
+    assert [l["custom_id"] for l in uploaded["lines"]] == ["0", "1", "2"]
+
+
+def test_lru_serves_repeat_without_redis(monkeypatch):
+    reads = []
+    monkeypatch.setattr(cache, "get_json", lambda key: reads.append(key))
+    monkeypatch.setattr(cache, "set_json", lambda key, value, ttl: None)
+    completions = FakeCompletions()
+    monkeypatch.setattr(mimi, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(mimi, "openai_client", fake_client(chat=SimpleNamespace(completions=completions)))
+
+    payload = {"topic_hint": "lru", "pdf_text_excerpt": "", "image_descriptions": [], "age": 9}
+    first = mimi._chat_json_strict(payload)
+    first["ui_steps"] = ["mutated by caller"]
+    second = mimi._chat_json_strict(payload)
+
+    assert completions.calls == 1
+    assert len(reads) == 1
+    assert "ui_steps" not in second
+
+
+def test_excerpt_is_squashed_and_deduped():
+    text = "Page 1\n  Le   chat\tdort.\n\nPage 1\nLe chat dort.\nLa souris court.\n"
+    payload = mimi._trim_payload({
+        "pdf_text_excerpt": text,
+        "image_descriptions": ["chat", "x" * 400, "", 3],
+    })
+    assert payload["pdf_text_excerpt"] == "Page 1\nLe chat dort.\nLa souris court."
+    assert payload["image_descriptions"] == ["chat"]
+
+
+def test_valid_response_fast_path_matches_normalizer():
+    activity = {"name": "", "minutes": "5", "teacher_script": "Regarde !"}
+    lesson = {
+        "title": "Les couleurs",
+        "duration": "30 min",
+        "objectives": ["Nommer les couleurs", "Dire 'C'est rouge'"],
+        "materials": ["Crayons"],
+        "image_prompts": [{"id": "", "prompt": "arc-en-ciel"}, {"id": "x", "prompt": ""}],
+        "quiz": [{"question": "Rouge ?", "options": ["red", "blue"], "correct_option": "red"}],
+        "first_tutor_messages": [],
+        **{k: dict(activity) for k in mimi._ACTIVITY_KEYS},
+    }
+    lesson["homework"] = {"name": "Devoirs", "minutes": "", "teacher_script": ""}
+
+    assert mimi._is_canonical(lesson)
+    assert not mimi._is_canonical(LESSON)
+    fast = mimi._canonical_lesson(lesson)
+    assert fast == mimi._normalize_to_strict_schema(lesson)
+    assert list(fast) == list(mimi._normalize_to_strict_schema(lesson))
+
+
+def test_build_mimi_lessons_fans_out_and_keeps_order(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(cache, "get_json", lambda key: None)
+    monkeypatch.setattr(cache, "set_json", lambda key, value, ttl: None)
+    monkeypatch.setattr(mimi, "OPENAI_RETRIES", 0)
+    in_flight = []
+
+    class AsyncCompletions:
+        async def create(self, **kwargs):
+            in_flight.append(1)
+            await asyncio.sleep(0.01)
+            if "boom" in kwargs["messages"][-1]["content"]:
+                raise RuntimeError("boom")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(LESSON)))])
+
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=AsyncCompletions()))
+    monkeypatch.setattr(mimi, "_async_openai_client", lambda: fake)
+    closed = []
+
+    async def close():
+        closed.append(1)
+
+    monkeypatch.setattr(mimi, "close_async_openai_client", close)
+
+    lessons = asyncio.run(mimi.build_mimi_lessons([{"topic": "a"}, {"topic": "boom"}, {"topic": "c"}]))
+    assert [l and l["title"] for l in lessons] == ["Les couleurs", None, "Les couleurs"]
+    assert len(in_flight) == 3
+    assert closed == [1]
+
+
+def test_build_lessons_cli_writes_one_line_per_item(monkeypatch, tmp_path, capsys):
+    from app import build_lessons
+
+    async def fake_build(items):
+        return [None if r["topic"] == "boom" else {"title": r["topic"]} for r in items]
+
+    monkeypatch.setattr(mimi, "build_mimi_lessons", fake_build)
+    src = tmp_path / "items.jsonl"
+    src.write_text('{"topic": "été"}\n\n{"topic": "boom"}\n', encoding="utf-8")
+
+    assert build_lessons.main([str(src)]) == 1
+    out = capsys.readouterr()
+    assert out.out.splitlines() == ['{"title": "été"}', "null"]
+    assert "1/2 lessons built" in out.err
+
+    monkeypatch.setattr(mimi, "build_mimi_lesson_batch", lambda items: [{"title": "batch"} for _ in items])
+    assert build_lessons.main(["--batch", str(src)]) == 0
+    assert capsys.readouterr().out.splitlines() == ['{"title": "batch"}'] * 2
+
+
+def test_scanner_stops_at_object_end_and_rejects_prose():
+    scanner = mimi._TopLevelScanner()
+    assert scanner.feed('```json\n{"title": "A", ') == [("title", "A")]
+    assert scanner.feed('"age": 9}\n``` trailing') == [("age", 9)]
+    assert scanner.closed
+    with pytest.raises(ValueError):
+        mimi._TopLevelScanner().feed("Sorry, I can't help with that.")
+
+
+def test_loose_extraction_picks_the_lesson_among_stray_braces():
+    text = 'Voici {la leçon} : {"title": "Les couleurs", "note": "a } brace"} et {"x": 1}'
+    assert mimi._extract_json_loose(text) == {"title": "Les couleurs", "note": "a } brace"}
@@ -0,0 +1,164 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app import ocr_abbyy
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.headers_seen = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.headers_seen.append(dict(headers or {}))
+        status = self.statuses.pop(0)
+        if status is None:
+            return SimpleNamespace(status_code=304, headers={})
+        return SimpleNamespace(
+            status_code=200,
+            headers={"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+            content=json.dumps({"taskId": "t1", "status": status, "resultUrls": []}).encode(),
+            raise_for_status=lambda: None,
+        )
+
+
+def test_poll_task_backs_off_and_learns_duration(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ocr_abbyy.time, "sleep", sleeps.append)
+    monkeypatch.setattr(ocr_abbyy, "_task_seconds", {})
+    session = FakeSession(["InProgress", None, "Completed"])
+    monkeypatch.setattr(ocr_abbyy, "_client", session)
+
+    st = ocr_abbyy._poll_task("t1", bucket=(False, 10))
+
+    assert st["status"] == "Completed"
+    assert sleeps == [0.5, 0.75, 1.125]
+    assert "If-Modified-Since" not in session.headers_seen[0]
+    assert session.headers_seen[1]["If-Modified-Since"].startswith("Mon")
+    assert (False, 10) in ocr_abbyy._task_seconds
+
+
+def test_avg_conf_from_xml_bytes_and_str():
+    xml = '<document><page><line><char confidence="90"/><char confidence="70.0"/></line></page></document>'
+    assert abs(ocr_abbyy._avg_conf_from_xml(xml.encode()) - 0.8) < 1e-9
+    assert abs(ocr_abbyy._avg_conf_from_xml(xml) - 0.8) < 1e-9
+    assert ocr_abbyy._avg_conf_from_xml(b"<document/>") == 1.0
+
+
+def test_conf_scan_sees_matches_split_across_chunks():
+    xml = b'<a confidence="90"/><b confidence="70"/><c confidence="80"/>'
+    chunks = [xml[i:i + 7] for i in range(0, len(xml), 7)]
+    assert ocr_abbyy._conf_scan(chunks) == (240.0, 3)
+
+
+def test_xml_task_and_walk_fallback_without_xmltodict():
+    ns = 'xmlns="http://www.abbyy.com/ReceiptCaptureSDK_xml/ReceiptCapture-1.0.xsd"'
+    resp = SimpleNamespace(
+        content=f'<response {ns}><task id="t1" status="Completed"><resultUrls><url>https://x/a.txt</url>'
+        f'<url>https://x/a.xml</url></resultUrls></task></response>'.encode(),
+    )
+    assert ocr_abbyy._as_json(resp) == {
+        "taskId": "t1", "status": "Completed", "resultUrls": ["https://x/a.txt", "https://x/a.xml"],
+    }
+    xml = f'<document {ns}><page><line><formatting><charParams><confidence>60</confidence></charParams>' \
+          f'<charParams><confidence>80</confidence></charParams></formatting></line></page></document>'
+    assert abs(ocr_abbyy._avg_conf_from_xml(xml) - 0.7) < 1e-9
+
+
+def test_fast_policy_skips_xml_for_substantial_text(monkeypatch):
+    fetched = []
+    monkeypatch.setattr(ocr_abbyy, "ABBYY_APP_ID", "id")
+    monkeypatch.setattr(ocr_abbyy, "ABBYY_APP_PASSWORD", "pw")
+    monkeypatch.setattr(ocr_abbyy, "OCR_CONF_POLICY", "fast")
+    monkeypatch.setattr(ocr_abbyy, "_poll_task", lambda task_id, **kw: {
+        "status": "Completed", "resultUrls": ["https://x/r.txt", "https://x/r.xml"],
+    })
+    monkeypatch.setattr(ocr_abbyy, "_client", SimpleNamespace(post=lambda *a, **k: SimpleNamespace(
+        raise_for_status=lambda: None, content=b'{"taskId": "t1"}',
+    )))
+    monkeypatch.setattr(ocr_abbyy, "_download", lambda url: fetched.append(url) or "mot " * 200)
+    monkeypatch.setattr(ocr_abbyy, "_download_conf", lambda url: fetched.append(url) or 0.1)
+
+    assert ocr_abbyy.ocr_file_to_text(b"img", is_pdf=False).startswith("mot")
+    assert fetched == ["https://x/r.txt"]
+
+
+def test_page_ocr_discards_low_confidence_instead_of_exiting(monkeypatch):
+    import pytest
+
+    monkeypatch.setattr(ocr_abbyy, "ABBYY_APP_ID", "id")
+    monkeypatch.setattr(ocr_abbyy, "ABBYY_APP_PASSWORD", "pw")
+    monkeypatch.setattr(ocr_abbyy, "_poll_task", lambda task_id, **kw: {"status": "Completed", "resultUrls": []})
+    monkeypatch.setattr(ocr_abbyy, "ocr_submit", lambda *a: "t1")
+    monkeypatch.setattr(ocr_abbyy, "_fetch_text_conf", lambda st: ("~ ~", 0.2))
+
+    assert ocr_abbyy.ocr_file_to_text(b"page", is_pdf=False, exit_on_low_conf=False) == ""
+    with pytest.raises(SystemExit):
+        ocr_abbyy.ocr_file_to_text(b"page", is_pdf=False)
+
+
+def test_ocr_result_checks_once_and_caches_finished_text(monkeypatch):
+    store = {}
+    monkeypatch.setattr(ocr_abbyy.cache, "get_json", lambda key: store.get(key))
+    monkeypatch.setattr(ocr_abbyy.cache, "set_json", lambda key, value, ttl: store.__setitem__(key, value))
+    monkeypatch.setattr(ocr_abbyy, "_fetch_text_conf", lambda st: ("bonjour", 0.99))
+    session = FakeSession(["InProgress", "Completed"])
+    monkeypatch.setattr(ocr_abbyy, "_client", session)
+
+    assert ocr_abbyy.ocr_result("t1") == {"status": "InProgress"}
+    assert ocr_abbyy.ocr_result("t1") == {"status": "Completed", "text": "bonjour"}
+    assert ocr_abbyy.ocr_result("t1") == {"status": "Completed", "text": "bonjour"}
+    assert len(session.headers_seen) == 2
+
+
+def test_ocr_result_reports_low_confidence_instead_of_exiting(monkeypatch):
+    monkeypatch.setattr(ocr_abbyy.cache, "get_json", lambda key: None)
+    monkeypatch.setattr(ocr_abbyy.cache, "set_json", lambda key, value, ttl: None)
+    monkeypatch.setattr(ocr_abbyy, "_fetch_text_conf", lambda st: ("b?nj??r", 0.4))
+    monkeypatch.setattr(ocr_abbyy, "_client", FakeSession(["Completed"]))
+
+    assert ocr_abbyy.ocr_result("t1") == {"status": "LowConfidence", "text": "", "confidence": 0.4}
+
+
+def test_submissions_are_paced_to_the_configured_rate(monkeypatch):
+    clock = [100.0]
+    sleeps = []
+    monkeypatch.setattr(ocr_abbyy.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(ocr_abbyy.time, "sleep", sleeps.append)
+    monkeypatch.setattr(ocr_abbyy, "OCR_SUBMIT_RPS", 4)
+    monkeypatch.setattr(ocr_abbyy, "_next_submit", 0.0)
+
+    for _ in range(3):
+        ocr_abbyy._pace_submit()
+    clock[0] = 101.0
+    ocr_abbyy._pace_submit()
+
+    assert sleeps == [0.25, 0.5]
+
+
+
+def test_avg_conf_walk_keeps_the_tree_small(monkeypatch):
+    monkeypatch.setattr(ocr_abbyy, "_WALK_ROOT_CLEAR_EVERY", 7)
+    chars = '<charParams confidence="90"/><charParams><confidence>70</confidence></charParams>' * 500
+    xml = f'<document><page><block>{chars}</block></page>' + f'<page>{chars}</page>' * 20 + '</document>'
+
+    real_iterparse = ocr_abbyy.ET.iterparse
+    sizes = []
+
+    def iterparse(source, events):
+        root = None
+        for event, elem in real_iterparse(source, ("start", "end")):
+            root = root if root is not None else elem
+            sizes.append(len(root) + sum(len(child) for child in root))
+            if event in events:
+                yield event, elem
+
+    monkeypatch.setattr(ocr_abbyy.ET, "iterparse", iterparse)
+    assert abs(ocr_abbyy._avg_conf_walk(xml.encode()) - 0.8) < 1e-9
+    # iterparse reads ahead in 16 KiB chunks, so a few hundred elements can exist at once;
+    # without clearing, all 21 pages and their 21000 chars stay attached to the root
+    assert max(sizes) < 2000
@@ -0,0 +1,143 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app.tasks as tasks
+
+
+class FakeQuery:
+    def __init__(self, db):
+        self.db = db
+
+    def update(self, fields):
+        self.db.writes.append(("update", fields))
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def execute(self):
+        return SimpleNamespace(data=None)
+
+
+class FakeDB:
+    def __init__(self):
+        self.writes = []
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+def fake_download(body):
+    def get(url, timeout=None, stream=False):
+        return SimpleNamespace(content=body, raise_for_status=lambda: None)
+    return SimpleNamespace(get=get)
+
+
+def test_identical_upload_reuses_cached_lesson(monkeypatch):
+    db = FakeDB()
+    store = {}
+    monkeypatch.setattr(tasks, "supabase", db)
+    monkeypatch.setattr(tasks, "_storage_http", fake_download(b"\x89PNG same scan"))
+    monkeypatch.setattr(tasks.cache, "get_json", lambda key: store.get(key))
+    monkeypatch.setattr(tasks.cache, "set_json", lambda key, value, ttl: store.__setitem__(key, value))
+    monkeypatch.setattr(tasks.cache, "acquire_lock", lambda key, ttl: True)
+    monkeypatch.setattr(tasks.cache, "release_lock", lambda key: None)
+    ocr_calls = []
+    from app import mimi, ocr_abbyy
+
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", lambda **kw: ocr_calls.append(1) or "Le chat dort.")
+    monkeypatch.setattr(mimi, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(mimi, "build_mimi_lesson", lambda **kw: {"title": "Le chat", "ui_steps": []})
+
+    tasks.process_lesson.run("l1", "uploads/a.png", "c1")
+    tasks.process_lesson.run("l2", "uploads/b.png", "c1")
+
+    assert len(ocr_calls) == 1
+    final = [fields for op, fields in db.writes if op == "update" and fields.get("status") == "completed"]
+    assert [f["lesson_data"]["title"] for f in final] == ["Le chat", "Le chat"]
+    assert final[1]["ocr_text"] == "Le chat dort."
+
+
+def test_job_writes_ocr_text_with_the_final_status(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(tasks, "supabase", db)
+    monkeypatch.setattr(tasks, "_storage_http", fake_download(b"\x89PNG scan"))
+    monkeypatch.setattr(tasks, "FILE_LESSON_TTL", 0)
+    from app import mimi, ocr_abbyy
+
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", lambda **kw: "Le chat dort.")
+    monkeypatch.setattr(mimi, "build_mimi_lesson", lambda **kw: {"title": "Le chat", "ui_steps": []})
+
+    tasks.process_lesson.run("l1", "uploads/a.png", "c1")
+
+    assert [op for op, _ in db.writes] == ["update"]
+    final = db.writes[-1][1]
+    assert final["status"] == "completed"
+    assert final["ocr_text"] == "Le chat dort." and final["lesson_data"]["title"] == "Le chat"
+
+
+def test_download_lands_in_ram_dir_only_when_it_fits(monkeypatch, tmp_path):
+    import io
+
+    monkeypatch.setattr(tasks, "DOWNLOAD_TMP_DIR", str(tmp_path))
+    free = tasks.shutil.disk_usage(str(tmp_path)).free
+    assert tasks._download_tmp_dir(1024) == str(tmp_path)
+    assert tasks._download_tmp_dir(free) is None
+    assert tasks._download_tmp_dir(0) is None
+
+    class Response:
+        headers = {"Content-Length": "7"}
+        raw = io.BytesIO(b"%PDF-1.")
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def raise_for_status(self):
+            pass
+
+    monkeypatch.setattr(tasks, "_storage_http", SimpleNamespace(get=lambda url, timeout, stream: Response()))
+    path = tasks._download_to_path("https://example/x.pdf", suffix=".pdf")
+    assert os.path.dirname(path) == str(tmp_path)
+    with open(path, "rb") as f:
+        assert f.read() == b"%PDF-1."
+
+
+def test_upload_is_routed_by_magic_bytes_not_name(monkeypatch):
+    monkeypatch.setattr(tasks, "supabase", FakeDB())
+    monkeypatch.setattr(tasks, "FILE_LESSON_TTL", 0)
+    from app import mimi, ocr_abbyy
+
+    seen = []
+    monkeypatch.setattr(tasks, "extract_text_from_pdf", lambda src, language: seen.append(("pdf", src)) or "Le chat.")
+    monkeypatch.setattr(ocr_abbyy, "ocr_file_to_text", lambda **kw: seen.append(("img", kw["image_format"])) or "Le chat.")
+    monkeypatch.setattr(mimi, "build_mimi_lesson", lambda **kw: {"title": "Le chat", "ui_steps": []})
+
+    monkeypatch.setattr(tasks, "_storage_http", fake_download(b"%PDF-1.7 body"))
+    tasks.process_lesson.run("l1", "uploads/scan.png", "c1")
+    monkeypatch.setattr(tasks, "_storage_http", fake_download(b"\xff\xd8\xff\xe0 jfif"))
+    tasks.process_lesson.run("l2", "uploads/photo.png", "c1")
+
+    assert seen == [("pdf", b"%PDF-1.7 body"), ("img", "jpg")]
+    assert tasks._sniff_ext(b"junk\n%PDF-1.4") == ".pdf" and tasks._sniff_ext(b"plain text") is None
+
+
+def test_duplicate_job_requeues_instead_of_blocking(monkeypatch):
+    import pytest
+    from celery.exceptions import Retry
+
+    db = FakeDB()
+    monkeypatch.setattr(tasks, "supabase", db)
+    monkeypatch.setattr(tasks, "_storage_http", fake_download(b"\x89PNG busy scan"))
+    monkeypatch.setattr(tasks.cache, "get_json", lambda key: None)
+    monkeypatch.setattr(tasks.cache, "acquire_lock", lambda key, ttl: False)
+    monkeypatch.setattr(tasks.time, "sleep", lambda s: pytest.fail("must not sleep-poll"))
+
+    with pytest.raises(Retry):
+        tasks.process_lesson.run("l1", "uploads/a.png", "c1")
+    assert db.writes == []  # the row stays "processing" for the retry